@@ -10,6 +10,7 @@ from azure.ai.projects import AIProjectClient
 from openai import AzureOpenAI
 from opentelemetry import trace
 from config import Settings
+from obo_token_cache import OboTokenCache
 import logging
 import asyncio
 import json
@@ -17,6 +18,9 @@ import json
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
+# Scope for Azure AI Foundry (https://ai.azure.com is the correct audience)
+AZURE_AI_SCOPES = ["https://ai.azure.com/.default"]
+
 
 class TokenCredential:
     """Custom credential wrapper for MSAL token."""
@@ -44,20 +48,23 @@ class AIFoundryService:
         self.visualization_service = visualization_service
         
         # Initialize MSAL Confidential Client Application for OBO flow
+        # (one app per service so its token cache and HTTP session are reused)
         self.msal_app = msal.ConfidentialClientApplication(
             client_id=self.ai_foundry_settings.app_client_id,
             client_credential=self.ai_foundry_settings.app_client_secret,
             authority=f"https://login.microsoftonline.com/{self.ai_foundry_settings.tenant_id}"
         )
+        self._obo_cache = OboTokenCache()
         
         logger.info(f"✓ Azure AI Foundry service initialized")
         logger.info(f"  Project: {self.ai_foundry_settings.project_name}")
         logger.info(f"  Agent: {self.ai_foundry_settings.agent_id}")
         logger.info(f"  Endpoint: {self.ai_foundry_settings.host}")
     
-    def _get_azure_ai_token(self, user_token: str) -> str:
+    async def _get_azure_ai_token(self, user_token: str) -> str:
         """
         Exchange user token for Azure AI services token using MSAL On-Behalf-Of flow.
+        The MSAL call is run in a thread to avoid blocking the event loop.
         
         Args:
             user_token: The user's access token from the frontend
@@ -65,21 +72,25 @@ class AIFoundryService:
         Returns:
             Access token for Azure AI services
         """
+        # Skip the OBO exchange while a token for this user is still valid
+        cached_token = self._obo_cache.get(user_token, AZURE_AI_SCOPES)
+        if cached_token:
+            return cached_token
+        
         max_retries = 3
         last_exception = None
         
         for attempt in range(1, max_retries + 1):
             try:
-                # Scope for Azure AI Foundry (https://ai.azure.com is the correct audience)
-                scopes = ["https://ai.azure.com/.default"]
-                
                 # Perform On-Behalf-Of token exchange
-                result = self.msal_app.acquire_token_on_behalf_of(
+                result = await asyncio.to_thread(
+                    self.msal_app.acquire_token_on_behalf_of,
                     user_assertion=user_token,
-                    scopes=scopes
+                    scopes=AZURE_AI_SCOPES
                 )
                 
                 if "access_token" in result:
+                    self._obo_cache.put(user_token, AZURE_AI_SCOPES, result)
                     if attempt > 1:
                         logger.info(f"Successfully acquired Azure AI token via OBO flow (attempt {attempt})")
                     else:
@@ -97,13 +108,14 @@ class AIFoundryService:
                 last_exception = e
                 logger.warning(f"MSAL OBO flow attempt {attempt}/{max_retries} failed: {e}")
                 if attempt < max_retries:
-                    import time
-                    time.sleep(0.5 * attempt)  # Back off: 0.5s, 1s
-                    # Recreate MSAL app in case the HTTP session is broken
+                    await asyncio.sleep(0.5 * attempt)  # Back off: 0.5s, 1s
+                    # Recreate MSAL app in case the HTTP session is broken,
+                    # carrying over its token cache so cached tokens survive
                     self.msal_app = msal.ConfidentialClientApplication(
                         client_id=self.ai_foundry_settings.app_client_id,
                         client_credential=self.ai_foundry_settings.app_client_secret,
-                        authority=f"https://login.microsoftonline.com/{self.ai_foundry_settings.tenant_id}"
+                        authority=f"https://login.microsoftonline.com/{self.ai_foundry_settings.tenant_id}",
+                        token_cache=self.msal_app.token_cache
                     )
         
         logger.error(f"Error in MSAL OBO flow after {max_retries} attempts: {last_exception}")
@@ -128,7 +140,7 @@ class AIFoundryService:
         """
         try:
             # Get Azure AI token via OBO flow
-            azure_ai_token = self._get_azure_ai_token(user_token)
+            azure_ai_token = await self._get_azure_ai_token(user_token)
             credential = TokenCredential(azure_ai_token)
             
             # Create AI Project Client with OBO token
@@ -210,7 +222,7 @@ class AIFoundryService:
             Dict with cancellation results
         """
         try:
-            azure_ai_token = self._get_azure_ai_token(user_token)
+            azure_ai_token = await self._get_azure_ai_token(user_token)
             credential = TokenCredential(azure_ai_token)
             
             client = AIProjectClient(
@@ -268,7 +280,7 @@ class AIFoundryService:
             Dict with replay results
         """
         try:
-            azure_ai_token = self._get_azure_ai_token(user_token)
+            azure_ai_token = await self._get_azure_ai_token(user_token)
             credential = TokenCredential(azure_ai_token)
             
             client = AIProjectClient(
@@ -380,7 +392,7 @@ class AIFoundryService:
         """
         try:
             # Get Azure AI token via OBO flow
-            azure_ai_token = self._get_azure_ai_token(user_token)
+            azure_ai_token = await self._get_azure_ai_token(user_token)
             credential = TokenCredential(azure_ai_token)
             
             # Create AI Project Client with OBO token
@@ -615,7 +627,7 @@ class AIFoundryService:
             
             # Reuse pre-acquired token if available, otherwise acquire via OBO
             if not azure_ai_token:
-                azure_ai_token = self._get_azure_ai_token(user_token)
+                azure_ai_token = await self._get_azure_ai_token(user_token)
             
             # Create Azure OpenAI client
             openai_client = AzureOpenAI(
@@ -785,7 +797,7 @@ Generate {max_questions} relevant follow-up questions in the JSON object format
         """
         try:
             # Get Azure AI token via OBO flow
-            azure_ai_token = self._get_azure_ai_token(user_token)
+            azure_ai_token = await self._get_azure_ai_token(user_token)
             credential = TokenCredential(azure_ai_token)
             
             # Create AI Project Client with OBO token
@@ -857,7 +869,7 @@ Generate {max_questions} relevant follow-up questions in the JSON object format
                 return fallback_title
             
             # Get Azure AI token via OBO flow
-            azure_ai_token = self._get_azure_ai_token(user_token)
+            azure_ai_token = await self._get_azure_ai_token(user_token)
             
             # Create Azure OpenAI client
             openai_client = AzureOpenAI(
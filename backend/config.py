@@ -152,6 +152,7 @@ class FabricLakehouseSettings(BaseSettings):
     # Connection settings
     connection_timeout: int = 30  # seconds
     query_timeout: int = 60  # seconds
+    keepalive_interval: int = 60  # seconds between idle keepalive pings (0 disables)
     
     def is_configured(self) -> bool:
         """Check if all required fields are configured."""
@@ -207,6 +208,10 @@ class Settings(BaseSettings):
     COSMOS_DB_DATABASE_NAME: str = "ContosoSuites"
     COSMOS_DB_SESSIONS_CONTAINER: str = "Sessions"
     COSMOS_DB_MESSAGES_CONTAINER: str = "Messages"
+    COSMOS_DB_TEMPLATES_CONTAINER: str = "QueryTemplates"
+    # Seconds a worker caches a user's conversation list (0 disables). Writes through
+    # the same worker invalidate it immediately; other workers may lag by up to this TTL.
+    CONVERSATION_LIST_CACHE_TTL: int = 30
     
     # Copilot Studio Configuration
     copilot_studio: Optional[CopilotStudioSettings] = None
@@ -3,7 +3,8 @@ Conversation service for managing chat sessions and messages across different ag
 This service provides a unified interface for conversation management that can be used
 by multiple chatbot implementations (Copilot Studio, AI Foundry, etc.).
 """
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from cachetools import TTLCache
 from cosmos_service import CosmosDBService
 from chat_models import (
     ChatConversation,
@@ -15,27 +16,53 @@ from chat_models import (
     AddMessageRequest
 )
 from datetime import datetime
+import asyncio
 import logging
 import uuid
 
 logger = logging.getLogger(__name__)
 
 
+async def _iter_messages(messages: List[ChatMessage]) -> AsyncIterator[ChatMessage]:
+    for message in messages:
+        yield message
+
+
 class ConversationService:
     """
     Unified service for managing conversations and messages.
     Provides agent-agnostic methods for conversation storage and retrieval.
     """
     
-    def __init__(self, cosmos_service: Optional[CosmosDBService] = None):
+    def __init__(self, cosmos_service: Optional[CosmosDBService] = None, list_cache_ttl: int = 30):
         """
         Initialize the conversation service.
         
         Args:
             cosmos_service: Optional Cosmos DB service for persistence
+            list_cache_ttl: Seconds to cache a user's Cosmos conversation list (0 disables)
         """
         self.cosmos_service = cosmos_service
         self._in_memory_store: dict = {}  # Fallback for when Cosmos is not available
+        
+        # Short-lived cache of Cosmos conversation list pages, so a sidebar that
+        # polls doesn't re-run the list query (plus per-session count/last-message
+        # lookups) every time. Keyed by user_id -> {(agent_id, limit, token): page};
+        # a user's entry is dropped whenever this process changes their conversations.
+        self._list_cache: Optional[TTLCache] = (
+            TTLCache(maxsize=1024, ttl=list_cache_ttl) if list_cache_ttl > 0 else None
+        )
+        # In-flight Cosmos list queries, so identical concurrent requests (several
+        # tabs refreshing at once) share one query instead of each issuing their own
+        self._list_inflight: Dict[Tuple, asyncio.Task] = {}
+    
+    def _invalidate_list_cache(self, user_id: str) -> None:
+        if self._list_cache is not None:
+            self._list_cache.pop(user_id, None)
+        # Queries already in flight may predate the write; detach them so the
+        # next caller starts a fresh one instead of joining a stale result
+        for key in [k for k in self._list_inflight if k[0] == user_id]:
+            self._list_inflight.pop(key, None)
     
     async def create_conversation(
         self,
@@ -90,6 +117,7 @@ class ConversationService:
                     session_data=session.session_data
                 )
                 
+                self._invalidate_list_cache(user_id)
                 logger.info(f"Created conversation in Cosmos: {conversation.id} for agent: {agent_id}")
                 return conversation
                 
@@ -122,23 +150,50 @@ class ConversationService:
         self,
         user_id: str,
         limit: int = 50,
-        agent_id: Optional[str] = None
-    ) -> List[ConversationSummary]:
+        agent_id: Optional[str] = None,
+        continuation_token: Optional[str] = None
+    ) -> Tuple[List[ConversationSummary], Optional[str]]:
         """
-        Get conversation summaries for a user.
+        Get a page of conversation summaries for a user.
         
         Args:
             user_id: User identifier
             limit: Maximum number of conversations to return
             agent_id: Optional filter by agent ID
+            continuation_token: Token returned with the previous page, if any
             
         Returns:
-            List of ConversationSummary objects
+            Tuple of (ConversationSummary list, continuation token for the next page or None)
         """
         if self.cosmos_service:
+            page_key = (agent_id, limit, continuation_token)
+            user_pages: Optional[Dict] = None
+            if self._list_cache is not None:
+                user_pages = self._list_cache.get(user_id)
+                if user_pages is None:
+                    user_pages = self._list_cache[user_id] = {}
+                cached = user_pages.get(page_key)
+                if cached is not None:
+                    return cached
             try:
-                summaries = await self.cosmos_service.get_user_conversations(user_id, limit, agent_id)
-                return summaries
+                inflight_key = (user_id, *page_key)
+                task = self._list_inflight.get(inflight_key)
+                if task is None:
+                    task = asyncio.ensure_future(self.cosmos_service.get_user_conversations(
+                        user_id, limit, agent_id, continuation_token
+                    ))
+                    self._list_inflight[inflight_key] = task
+                    task.add_done_callback(
+                        lambda t: self._list_inflight.get(inflight_key) is t
+                        and self._list_inflight.pop(inflight_key)
+                    )
+                # Shielded so one caller disconnecting doesn't cancel the others' query
+                page = await asyncio.shield(task)
+                # If a write invalidated this user meanwhile, user_pages is detached
+                # from the cache and the (possibly stale) page is simply not kept
+                if user_pages is not None:
+                    user_pages[page_key] = page
+                return page
                 
             except Exception as e:
                 logger.error(f"Failed to get conversations from Cosmos: {e}")
@@ -172,7 +227,7 @@ class ConversationService:
             for conv in sorted(user_conversations, key=lambda x: x.updated_at, reverse=True)[:limit]
         ]
         
-        return summaries
+        return summaries, None
     
     async def get_conversation(
         self,
@@ -205,25 +260,38 @@ class ConversationService:
         
         return None
     
-    async def get_conversation_messages(
+    async def open_message_stream(
         self,
         conversation_id: str,
         user_id: str
-    ) -> List[ChatMessage]:
+    ) -> AsyncIterator[ChatMessage]:
         """
-        Get all messages for a conversation.
+        Check access to a conversation and return an async iterator over its
+        messages. Messages are read lazily, page by page, when Cosmos DB is used.
         
         Args:
             conversation_id: Conversation identifier
             user_id: User identifier (for authorization)
             
         Returns:
-            List of ChatMessage objects
+            Async iterator of ChatMessage objects (empty if not found)
         """
-        conversation = await self.get_conversation(conversation_id, user_id)
-        if conversation:
-            return conversation.messages
-        return []
+        if self.cosmos_service:
+            try:
+                if await self.cosmos_service.session_exists(conversation_id, user_id):
+                    return self.cosmos_service.iter_session_messages(conversation_id)
+                return _iter_messages([])
+                
+            except Exception as e:
+                logger.error(f"Failed to open message stream from Cosmos: {e}")
+                # Fall through to in-memory store
+        
+        # Fallback to in-memory store
+        conversation = self._in_memory_store.get(conversation_id)
+        if conversation and conversation.user_id == user_id:
+            return _iter_messages(conversation.messages)
+        
+        return _iter_messages([])
     
     async def add_message(
         self,
@@ -269,6 +337,7 @@ class ConversationService:
                 )
                 
                 if created_message_id:
+                    self._invalidate_list_cache(user_id)
                     logger.info(f"Added message {created_message_id} to conversation {conversation_id} in Cosmos")
                     return created_message_id
                     
@@ -398,6 +467,7 @@ class ConversationService:
             try:
                 success = await self.cosmos_service.delete_conversation(conversation_id, user_id)
                 if success:
+                    self._invalidate_list_cache(user_id)
                     logger.info(f"Deleted conversation {conversation_id} from Cosmos")
                     return True
                     
@@ -2,15 +2,19 @@
 Copilot Studio service for agent interactions.
 Handles session creation, message sending, and On-Behalf-Of authentication flow.
 """
-from typing import Dict, List, Optional, AsyncGenerator
+from typing import Dict, List, Optional, AsyncGenerator, AsyncIterator, Tuple
 from microsoft_agents.activity import Activity, ActivityTypes, ConversationAccount, CardAction
 from microsoft_agents.copilotstudio.client import ConnectionSettings, CopilotClient
 from msal import ConfidentialClientApplication
+from cachetools import TTLCache
 from config import Settings
+from obo_token_cache import OboTokenCache
 import logging
 
 logger = logging.getLogger(__name__)
 
+POWER_PLATFORM_SCOPES = ["https://api.powerplatform.com/.default"]
+
 
 class CopilotStudioService:
     """Service for interacting with Copilot Studio agents."""
@@ -33,6 +37,17 @@ class CopilotStudioService:
             )
         else:
             self._msal_app = None
+        self._obo_cache = OboTokenCache()
+        
+        # Connection settings come from immutable config, so build them once;
+        # Copilot clients are reused per Power Platform token (one per user
+        # until the token is refreshed). Only touched from the event loop.
+        self._connection_settings = self._create_connection_settings()
+        self._endpoint = (
+            f"https://{self.copilot_settings.environment_id}.api.powerplatform.com"
+            f"/v1.0/bots/{self.copilot_settings.schema_name}"
+        )
+        self._clients: TTLCache = TTLCache(maxsize=256, ttl=3600)
         
         logger.info(f"✓ Copilot Studio service initialized: environment_id={self.copilot_settings.environment_id}")
     
@@ -63,12 +78,17 @@ class CopilotStudioService:
         if not self._msal_app:
             raise ValueError("Client secret not configured")
         
+        # Skip the OBO exchange while a token for this user is still valid
+        cached_token = self._obo_cache.get(user_token, POWER_PLATFORM_SCOPES)
+        if cached_token:
+            return cached_token
+        
         import asyncio
         # Use the shared MSAL app (benefits from token cache)
         result = await asyncio.to_thread(
             self._msal_app.acquire_token_on_behalf_of,
             user_assertion=user_token,
-            scopes=["https://api.powerplatform.com/.default"]
+            scopes=POWER_PLATFORM_SCOPES
         )
         
         if "access_token" not in result:
@@ -76,6 +96,7 @@ class CopilotStudioService:
             logger.error(f"Failed to acquire Power Platform token: {error_msg}")
             raise Exception(f"Failed to acquire token: {error_msg}")
         
+        self._obo_cache.put(user_token, POWER_PLATFORM_SCOPES, result)
         return result["access_token"]
     
     async def _create_client(self, user_token: Optional[str] = None) -> CopilotClient:
@@ -88,15 +109,18 @@ class CopilotStudioService:
         Returns:
             Configured CopilotClient instance
         """
-        connection_settings = self._create_connection_settings()
-        
         if not user_token or not self.copilot_settings.app_client_secret:
             logger.warning("Creating Copilot client without token (no secret or user token)")
-            return CopilotClient(connection_settings, None)
+            return CopilotClient(self._connection_settings, None)
         
         # Get Power Platform token via On-Behalf-Of (now async)
         power_platform_token = await self._get_power_platform_token(user_token)
-        return CopilotClient(connection_settings, power_platform_token)
+        
+        client = self._clients.get(power_platform_token)
+        if client is None:
+            client = CopilotClient(self._connection_settings, power_platform_token)
+            self._clients[power_platform_token] = client
+        return client
     
     async def start_conversation(
         self, 
@@ -122,11 +146,21 @@ class CopilotStudioService:
             welcome_message = ""
             conversation_id = None
             
-            async for action in client.start_conversation(True):
-                if action.text:
-                    welcome_message = action.text
-                if hasattr(action, 'conversation') and action.conversation:
-                    conversation_id = action.conversation.id
+            # Stop reading as soon as the conversation ID and the welcome message
+            # are known, instead of waiting for the rest of the stream
+            activities = client.start_conversation(True)
+            try:
+                async for action in activities:
+                    if action.text and not welcome_message:
+                        welcome_message = action.text
+                    if hasattr(action, 'conversation') and action.conversation:
+                        conversation_id = action.conversation.id
+                    if welcome_message and conversation_id:
+                        break
+            finally:
+                aclose = getattr(activities, "aclose", None)
+                if aclose is not None:
+                    await aclose()
             
             if not conversation_id:
                 raise Exception("Failed to get conversation ID from Copilot Studio")
@@ -137,7 +171,7 @@ class CopilotStudioService:
                 "userName": user_name,
                 "environmentId": self.copilot_settings.environment_id,
                 "schemaName": self.copilot_settings.schema_name,
-                "endpoint": f"https://{self.copilot_settings.environment_id}.api.powerplatform.com/v1.0/bots/{self.copilot_settings.schema_name}",
+                "endpoint": self._endpoint,
                 "expiresIn": 3600,  # 1 hour
                 "sessionCreated": True,
                 "welcomeMessage": welcome_message
@@ -169,41 +203,13 @@ class CopilotStudioService:
         try:
             client = await self._create_client(user_token)
             
-            response_text = ""
-            attachments = []
-            activities = []
-            
-            async for activity in client.ask_question(
-                conversation_id=conversation_id,
-                question=message_text
-            ):
-                activities.append(activity)
-                            
-                if activity.type == ActivityTypes.typing:
-                    # logger.info(f"ACTIVITY [typing]: {activity.text}")
-                    continue
-                
-                elif activity.type == ActivityTypes.event:
-                    logger.info(f"ACTIVITY [event]: {activity.value}")
-                    continue
-                
-                elif activity.type == ActivityTypes.message:
-                    logger.info(f"ACTIVITY [message]: {activity.text}")
-                    
-                    # Extract text content
-                    if activity.text:
-                        response_text = activity.text
-                    
-                    # Extract attachments (including Adaptive Cards)
-                    if hasattr(activity, 'attachments') and activity.attachments:
-                        for attachment in activity.attachments:
-                            attachments.append({
-                                "contentType": attachment.content_type,
-                                "content": attachment.content,
-                                "name": getattr(attachment, 'name', None)
-                            })
-                else:
-                    logger.info(f"ACTIVITY [unknown type={activity.type}]: {activity}")
+            response_text, attachments, activities = await self._consume_activities(
+                client.ask_question(
+                    conversation_id=conversation_id,
+                    question=message_text
+                ),
+                log_activities=True
+            )
             
             # If no response was collected, use a default message
             if not response_text and not attachments:
@@ -219,7 +225,7 @@ class CopilotStudioService:
                 "text": response_text,
                 "attachments": attachments,
                 "conversationId": conversation_id,
-                "activities": [self._serialize_activity(a) for a in activities]
+                "activities": activities
             }
             
         except Exception as e:
@@ -254,49 +260,21 @@ class CopilotStudioService:
                 value=action_data
             )
             invoke_activity.conversation = ConversationAccount(id=conversation_id)
-                        
-            response_text = ""
-            attachments = []
-            activities = []
             
             # Try using ask_question_with_activity if available, otherwise fallback
             if hasattr(client, 'ask_question_with_activity'):
                 logger.info("Using ask_question_with_activity method")
-                async for activity in client.ask_question_with_activity(invoke_activity):
-                    activities.append(activity)
-                    
-                    if activity.type == ActivityTypes.message:
-                        if activity.text:
-                            response_text = activity.text
-                        
-                        if hasattr(activity, 'attachments') and activity.attachments:
-                            for attachment in activity.attachments:
-                                attachments.append({
-                                    "contentType": attachment.content_type,
-                                    "content": attachment.content,
-                                    "name": getattr(attachment, 'name', None)
-                                })
+                activity_stream = client.ask_question_with_activity(invoke_activity)
             else:
                 # Fallback: send as a regular message
                 logger.info("Using fallback method (ask_question)")
                 action_text = f"Card action: {action_data.get('action', 'submitted')}"
-                async for activity in client.ask_question(
+                activity_stream = client.ask_question(
                     conversation_id=conversation_id,
                     question=action_text
-                ):
-                    activities.append(activity)
-                    
-                    if activity.type == ActivityTypes.message:
-                        if activity.text:
-                            response_text = activity.text
-                        
-                        if hasattr(activity, 'attachments') and activity.attachments:
-                            for attachment in activity.attachments:
-                                attachments.append({
-                                    "contentType": attachment.content_type,
-                                    "content": attachment.content,
-                                    "name": getattr(attachment, 'name', None)
-                                })
+                )
+            
+            response_text, attachments, activities = await self._consume_activities(activity_stream)
             
             if not response_text and not attachments:
                 response_text = f"Card action '{action_data.get('action')}' processed."
@@ -311,13 +289,70 @@ class CopilotStudioService:
                 "text": response_text,
                 "attachments": attachments,
                 "conversationId": conversation_id,
-                "activities": [self._serialize_activity(a) for a in activities]
+                "activities": activities
             }
             
         except Exception as e:
             logger.error(f"Failed to send card response to Copilot Studio: {e}")
             raise
     
+    async def _consume_activities(
+        self,
+        activity_stream: AsyncIterator[Activity],
+        log_activities: bool = False
+    ) -> Tuple[str, List[Dict], List[Dict]]:
+        """
+        Drain a Copilot Studio activity stream.
+        
+        Args:
+            activity_stream: Activities returned by the Copilot client
+            log_activities: Log event/message/unknown activities as they arrive
+            
+        Returns:
+            Tuple of (last message text, attachments, serialized activities)
+        """
+        response_text = ""
+        attachments = []
+        activities = []
+        
+        # Activity logging uses lazy %-formatting: the message (and the Activity's
+        # potentially large str()) is only built if INFO is enabled
+        log_activities = log_activities and logger.isEnabledFor(logging.INFO)
+        
+        async for activity in activity_stream:
+            # Serialize as we go instead of keeping every Activity alive
+            activities.append(self._serialize_activity(activity))
+            
+            if activity.type == ActivityTypes.message:
+                if log_activities:
+                    logger.info("ACTIVITY [message]: %s", activity.text)
+                
+                # Extract text content
+                if activity.text:
+                    response_text = activity.text
+                
+                # Extract attachments (including Adaptive Cards)
+                if getattr(activity, 'attachments', None):
+                    attachments.extend(
+                        {
+                            "contentType": attachment.content_type,
+                            "content": attachment.content,
+                            "name": getattr(attachment, 'name', None)
+                        }
+                        for attachment in activity.attachments
+                    )
+            
+            elif not log_activities or activity.type == ActivityTypes.typing:
+                continue
+            
+            elif activity.type == ActivityTypes.event:
+                logger.info("ACTIVITY [event]: %s", activity.value)
+            
+            else:
+                logger.info("ACTIVITY [unknown type=%s]: %s", activity.type, activity)
+        
+        return response_text, attachments, activities
+    
     def _serialize_activity(self, activity: Activity) -> Dict:
         """Serialize an Activity object to a dictionary for JSON response."""
         return {
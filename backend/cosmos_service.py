@@ -7,7 +7,7 @@ import os
 from azure.cosmos.aio import CosmosClient
 from azure.cosmos import PartitionKey, exceptions
 from azure.identity.aio import DefaultAzureCredential, ManagedIdentityCredential, AzureCliCredential
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Tuple
 import logging
 from config import Settings
 
@@ -19,11 +19,44 @@ from chat_models import (
     ChatSession, ChatMessage, ChatConversation, ConversationSummary, 
     MessageRole, MessageSender
 )
+from models import QueryTemplate
 from datetime import datetime
-import uuid
 
 logger = logging.getLogger(__name__)
 
+# Partition key value for query templates that are not owned by a user
+PUBLIC_TEMPLATE_PARTITION = "public"
+
+# ID of the document (in the public partition) recording that the built-in
+# templates have been seeded, so deleted built-ins are not re-created
+TEMPLATE_SEED_MARKER_ID = "default_templates_seed_marker"
+
+# Max sessions whose message count / last message are fetched concurrently
+# when listing conversations (each session issues two queries)
+SESSION_EXTRAS_CONCURRENCY = 16
+
+# Sessions indexing policy: composite indexes matching the conversation list
+# query's equality filters + ORDER BY lastActiveAt DESC, so the sort is served
+# from the index. Only applied when the container is first created.
+SESSIONS_INDEXING_POLICY = {
+    "indexingMode": "consistent",
+    "includedPaths": [{"path": "/*"}],
+    "excludedPaths": [{"path": "/\"_etag\"/?"}],
+    "compositeIndexes": [
+        [
+            {"path": "/type", "order": "ascending"},
+            {"path": "/is_active", "order": "ascending"},
+            {"path": "/lastActiveAt", "order": "descending"}
+        ],
+        [
+            {"path": "/type", "order": "ascending"},
+            {"path": "/is_active", "order": "ascending"},
+            {"path": "/agentId", "order": "ascending"},
+            {"path": "/lastActiveAt", "order": "descending"}
+        ]
+    ]
+}
+
 class CosmosDBService:
     """Service for managing chat history in Cosmos DB using separate containers for sessions and messages."""
     
@@ -34,7 +67,9 @@ class CosmosDBService:
         self.database = None
         self.sessions_container = None  # Partitioned by userId
         self.messages_container = None  # Partitioned by sessionId
+        self.templates_container = None  # Partitioned by userId (owner, or "public")
         self._initialized = False
+        self._extras_semaphore = asyncio.Semaphore(SESSION_EXTRAS_CONCURRENCY)
     
     async def initialize(self):
         """Initialize Cosmos DB connection and ensure database/containers exist."""
@@ -92,6 +127,7 @@ class CosmosDBService:
             self.sessions_container = await self.database.create_container_if_not_exists(
                 id=self.settings.COSMOS_DB_SESSIONS_CONTAINER,
                 partition_key=PartitionKey(path="/userId"),
+                indexing_policy=SESSIONS_INDEXING_POLICY,
                 offer_throughput=400  # Minimum RU/s for autoscale
             )
             logger.info(f"✓ Cosmos DB: Sessions container ready (partition key: /userId)")
@@ -105,6 +141,15 @@ class CosmosDBService:
             )
             logger.info(f"✓ Cosmos DB: Messages container ready (partition key: /sessionId)")
             
+            # Create Query Templates container - partitioned by owning userId
+            logger.info(f"Cosmos DB: Creating/accessing templates container '{self.settings.COSMOS_DB_TEMPLATES_CONTAINER}'")
+            self.templates_container = await self.database.create_container_if_not_exists(
+                id=self.settings.COSMOS_DB_TEMPLATES_CONTAINER,
+                partition_key=PartitionKey(path="/userId"),
+                offer_throughput=400  # Minimum RU/s for autoscale
+            )
+            logger.info("✓ Cosmos DB: Templates container ready (partition key: /userId)")
+            
             self._initialized = True
             logger.info("✓ Cosmos DB: Initialization complete")
             
@@ -135,7 +180,7 @@ class CosmosDBService:
         if not self.sessions_container:
             raise Exception("Cosmos DB Sessions container not initialized")
         
-        session_id = f"sess_{uuid.uuid4().hex[:12]}"
+        session_id = f"sess_{os.urandom(6).hex()}"
         now = datetime.utcnow()
         
         session = ChatSession(
@@ -175,15 +220,28 @@ class CosmosDBService:
             logger.error(f"Failed to create session: {e}")
             raise
     
-    async def get_user_conversations(self, user_id: str, limit: int = 50, agent_id: Optional[str] = None) -> List[ConversationSummary]:
-        """Get conversation summaries for a user from Sessions container."""
+    async def get_user_conversations(
+        self,
+        user_id: str,
+        limit: int = 50,
+        agent_id: Optional[str] = None,
+        continuation_token: Optional[str] = None
+    ) -> Tuple[List[ConversationSummary], Optional[str]]:
+        """
+        Get one page of conversation summaries for a user from Sessions container.
+        Pages are read with Cosmos continuation tokens (single partition), so each
+        page costs the same RUs regardless of depth, unlike OFFSET/LIMIT.
+        
+        Returns:
+            (summaries, continuation token for the next page or None)
+        """
         await self.initialize()
         
         logger.info(f"Cosmos DB: Fetching conversations - user_id={user_id}, agent_id={agent_id}, limit={limit}")
         
         if not self.sessions_container:
             logger.error("❌ Cosmos DB: Sessions container not initialized")
-            return []
+            return [], None
         
         try:
             # Build query with optional agentId filter
@@ -195,12 +253,10 @@ class CosmosDBService:
                 WHERE s.userId = @user_id AND s.type = 'session' AND s.is_active = true 
                       AND s.agentId = @agent_id
                 ORDER BY s.lastActiveAt DESC
-                OFFSET 0 LIMIT @limit
                 """
                 parameters = [
                     {"name": "@user_id", "value": user_id},
-                    {"name": "@agent_id", "value": agent_id},
-                    {"name": "@limit", "value": limit}
+                    {"name": "@agent_id", "value": agent_id}
                 ]
                 logger.info(f"Cosmos DB: Query with agent filter - agent_id={agent_id}")
             else:
@@ -210,33 +266,39 @@ class CosmosDBService:
                 FROM s 
                 WHERE s.userId = @user_id AND s.type = 'session' AND s.is_active = true
                 ORDER BY s.lastActiveAt DESC
-                OFFSET 0 LIMIT @limit
                 """
                 parameters = [
-                    {"name": "@user_id", "value": user_id},
-                    {"name": "@limit", "value": limit}
+                    {"name": "@user_id", "value": user_id}
                 ]
                 logger.info("Cosmos DB: Query without agent filter")
             
             logger.info(f"Cosmos DB: Executing query on Sessions container with partition_key={user_id}")
             sessions = []
-            async for item in self.sessions_container.query_items(
+            pages = self.sessions_container.query_items(
                 query=query,
                 parameters=parameters,
-                partition_key=user_id
-            ):
-                sessions.append(item)
+                partition_key=user_id,
+                max_item_count=limit
+            ).by_page(continuation_token)
+            # Read a single page; the server stops after `limit` items
+            async for page in pages:
+                async for item in page:
+                    sessions.append(item)
+                break
+            next_token = pages.continuation_token
             
             logger.info(f"✓ Cosmos DB: Found {len(sessions)} sessions for user {user_id}")
             
             # Fetch message counts and last messages for ALL sessions in parallel
-            # instead of serially (N+1 → 2 parallel batches)
+            # instead of serially (N+1 → 2 parallel batches), bounded so a long
+            # conversation list doesn't burst the Messages container's RU/s
             async def _get_session_extras(session):
                 """Fetch count + last message concurrently for one session."""
-                count, last_msg = await asyncio.gather(
-                    self._get_message_count(session['id']),
-                    self._get_last_message(session['id'])
-                )
+                async with self._extras_semaphore:
+                    count, last_msg = await asyncio.gather(
+                        self._get_message_count(session['id']),
+                        self._get_last_message(session['id'])
+                    )
                 return count, last_msg
             
             extras = await asyncio.gather(
@@ -267,15 +329,15 @@ class CosmosDBService:
                     continue
             
             logger.info(f"✓ Cosmos DB: Returning {len(summaries)} conversation summaries")
-            return summaries
+            return summaries, next_token
             
         except exceptions.CosmosHttpResponseError as e:
             logger.error(f"❌ Cosmos DB HTTP Error getting conversations: status_code={e.status_code}, "
                         f"sub_status={getattr(e, 'sub_status', 'N/A')}, message={e.message}")
-            return []
+            raise
         except Exception as e:
             logger.error(f"❌ Cosmos DB: Failed to get conversations for user {user_id}: {type(e).__name__}: {e}")
-            return []
+            raise
 
     async def _get_message_count(self, session_id: str) -> int:
         """Get message count for a session."""
@@ -328,14 +390,19 @@ class CosmosDBService:
             return None
         
         try:
-            # Get session from Sessions container
-            session_item = await self.sessions_container.read_item(
-                item=session_id,
-                partition_key=user_id
-            )
-            
-            # Get messages from Messages container
-            messages = await self.get_session_messages(session_id)
+            # Start the messages query alongside the session read (two containers,
+            # no dependency between the calls), but cancel it as soon as the
+            # session turns out not to exist in this user's partition.
+            messages_task = asyncio.ensure_future(self.get_session_messages(session_id))
+            try:
+                session_item = await self.sessions_container.read_item(
+                    item=session_id,
+                    partition_key=user_id
+                )
+            except BaseException:
+                messages_task.cancel()
+                raise
+            messages = await messages_task
             
             # Convert to ChatConversation format
             conversation = ChatConversation(
@@ -360,49 +427,76 @@ class CosmosDBService:
             logger.error(f"Failed to get conversation {session_id}: {e}")
             return None
 
+    @staticmethod
+    def _message_from_item(item: dict) -> ChatMessage:
+        """Convert a Messages container document to a ChatMessage (legacy fields included)."""
+        created_at = datetime.fromisoformat(item['createdAt'].replace('Z', '+00:00'))
+        return ChatMessage(
+            id=item['id'],
+            sessionId=item['sessionId'],
+            role=MessageRole(item['role']),
+            content=item['content'],
+            tokens=item.get('tokens'),
+            createdAt=created_at,
+            attachments=item.get('attachments', []),
+            toolCalls=item.get('toolCalls'),
+            vector=item.get('vector'),
+            grounding=item.get('grounding'),
+            # Legacy compatibility
+            text=item['content'],
+            sender=MessageSender.USER if item['role'] == 'user' else MessageSender.BOT,
+            timestamp=created_at
+        )
+    
     async def get_session_messages(self, session_id: str) -> List[ChatMessage]:
         """Get all messages for a session."""
-        if not self.messages_container:
-            return []
-        
         try:
-            query = """
-            SELECT * FROM c 
-            WHERE c.sessionId = @session_id AND c.type = 'message'
-            ORDER BY c.createdAt ASC
-            """
-            parameters = [{"name": "@session_id", "value": session_id}]
-            
-            messages = []
-            async for item in self.messages_container.query_items(
-                query=query,
-                parameters=parameters,
-                partition_key=session_id
-            ):
-                # Convert to legacy format
-                message = ChatMessage(
-                    id=item['id'],
-                    sessionId=item['sessionId'],
-                    role=MessageRole(item['role']),
-                    content=item['content'],
-                    tokens=item.get('tokens'),
-                    createdAt=datetime.fromisoformat(item['createdAt'].replace('Z', '+00:00')),
-                    attachments=item.get('attachments', []),
-                    toolCalls=item.get('toolCalls'),
-                    vector=item.get('vector'),
-                    grounding=item.get('grounding'),
-                    # Legacy compatibility
-                    text=item['content'],
-                    sender=MessageSender.USER if item['role'] == 'user' else MessageSender.BOT,
-                    timestamp=datetime.fromisoformat(item['createdAt'].replace('Z', '+00:00'))
-                )
-                messages.append(message)
-            
-            return messages
-            
+            # The whole (single-conversation) partition is materialised anyway, so
+            # let the server pick the page size (-1) to minimise round trips
+            return [message async for message in self.iter_session_messages(session_id, page_size=-1)]
         except Exception as e:
             logger.error(f"Failed to get messages for session {session_id}: {e}")
             return []
+    
+    async def iter_session_messages(self, session_id: str, page_size: int = 100) -> AsyncIterator[ChatMessage]:
+        """
+        Yield a session's messages in order, fetching them from Cosmos DB one page
+        at a time so long histories are never held in memory all at once.
+        A page_size of -1 lets Cosmos DB choose the page size.
+        """
+        if not self.messages_container:
+            return
+        
+        query = """
+        SELECT * FROM c 
+        WHERE c.sessionId = @session_id AND c.type = 'message'
+        ORDER BY c.createdAt ASC
+        """
+        parameters = [{"name": "@session_id", "value": session_id}]
+        
+        async for item in self.messages_container.query_items(
+            query=query,
+            parameters=parameters,
+            partition_key=session_id,
+            max_item_count=page_size
+        ):
+            yield self._message_from_item(item)
+    
+    async def session_exists(self, session_id: str, user_id: str) -> bool:
+        """Check that a session exists in the user's partition (point read, no messages)."""
+        await self.initialize()
+        
+        if not self.sessions_container:
+            return False
+        
+        try:
+            await self.sessions_container.read_item(
+                item=session_id,
+                partition_key=user_id
+            )
+            return True
+        except exceptions.CosmosResourceNotFoundError:
+            return False
 
     async def update_message_feedback(
         self,
@@ -465,18 +559,15 @@ class CosmosDBService:
             return None
         
         try:
-            # Verify session exists and belongs to user
-            try:
-                await self.sessions_container.read_item(
-                    item=session_id,
-                    partition_key=user_id
-                )
-            except exceptions.CosmosResourceNotFoundError:
+            # Bump the session's lastActiveAt with a partial update; this also
+            # verifies the session exists and belongs to the user (404 otherwise)
+            session_item = await self._update_session_activity(session_id, user_id)
+            if session_item is None:
                 logger.warning(f"Session {session_id} not found for user {user_id}")
                 return None
             
             # Create new message with generated ID
-            message_id = f"msg_{uuid.uuid4().hex[:12]}"
+            message_id = f"msg_{os.urandom(6).hex()}"
             now = datetime.utcnow()
             
             # Convert string role to MessageRole enum
@@ -501,8 +592,10 @@ class CosmosDBService:
             
             await self.messages_container.create_item(body=item)
             
-            # Update session's lastActiveAt and title if needed
-            await self._update_session_activity(session_id, user_id, content, role)
+            # Only retitle the session once the message is actually stored
+            if (role == "user" and
+                session_item.get('title') in ['New Conversation', 'New Chat']):
+                await self._set_session_title_from_message(session_id, user_id, content)
             
             return message_id
             
@@ -545,34 +638,48 @@ class CosmosDBService:
     async def _update_session_activity(
         self, 
         session_id: str, 
-        user_id: str, 
-        content: str, 
-        role: str
-    ) -> None:
-        """Update session's last activity time and title if needed."""
+        user_id: str
+    ) -> Optional[dict]:
+        """
+        Update session's last activity time with a patch operation instead of
+        a read + full-document replace.
+        
+        Returns:
+            The patched session document, or None if the session does not exist
+            in the user's partition.
+        """
         try:
-            # Get current session
-            session_item = await self.sessions_container.read_item(
+            return await self.sessions_container.patch_item(
                 item=session_id,
-                partition_key=user_id
+                partition_key=user_id,
+                patch_operations=[
+                    {"op": "set", "path": "/lastActiveAt", "value": datetime.utcnow().isoformat()}
+                ]
             )
-            
-            # Update last activity
-            session_item['lastActiveAt'] = datetime.utcnow().isoformat()
-            
-            # Update title if this is the first user message and title is still default
-            if (role == "user" and 
-                session_item.get('title') in ['New Conversation', 'New Chat']):
-                session_item['title'] = content[:50] + ("..." if len(content) > 50 else "")
-            
-            # Save updated session
-            await self.sessions_container.replace_item(
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+    
+    async def _set_session_title_from_message(
+        self, 
+        session_id: str, 
+        user_id: str, 
+        content: str
+    ) -> None:
+        """Title a session after its first user message if it still has the default title."""
+        # The filter predicate keeps a concurrent rename from being overwritten
+        try:
+            await self.sessions_container.patch_item(
                 item=session_id,
-                body=session_item
+                partition_key=user_id,
+                patch_operations=[
+                    {"op": "set", "path": "/title", "value": content[:50] + ("..." if len(content) > 50 else "")}
+                ],
+                filter_predicate="FROM c WHERE c.title IN ('New Conversation', 'New Chat')"
             )
-            
+        except exceptions.CosmosAccessConditionFailedError:
+            pass
         except Exception as e:
-            logger.warning(f"Failed to update session activity for {session_id}: {e}")
+            logger.warning(f"Failed to update session title for {session_id}: {e}")
     
     async def update_session_model(self, user_id: str, thread_id: str, model: str) -> bool:
         """Update the model field on a session identified by its conversation_id (AI Foundry thread ID)."""
@@ -710,6 +817,149 @@ class CosmosDBService:
             logger.error(f"Failed to delete messages for session {session_id}: {e}")
             return False
     
+    # ------------------------------------------------------------------
+    # Query templates
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _template_partition(user_id: Optional[str]) -> str:
+        """Partition key value for a template owner (public templates share one partition)."""
+        return user_id or PUBLIC_TEMPLATE_PARTITION
+    
+    def _template_to_item(self, template: QueryTemplate) -> dict:
+        item = template.model_dump(mode='json')
+        item['userId'] = self._template_partition(template.user_id)
+        item['type'] = 'query_template'
+        return item
+    
+    async def create_query_template(self, template: QueryTemplate) -> None:
+        """Insert a new query template into the Templates container."""
+        await self.initialize()
+        
+        if not self.templates_container:
+            raise Exception("Cosmos DB Templates container not initialized")
+        
+        await self.templates_container.create_item(body=self._template_to_item(template))
+    
+    async def replace_query_template(self, template: QueryTemplate) -> bool:
+        """
+        Replace an existing query template. Unlike an upsert, this never recreates
+        a template that has been deleted in the meantime.
+        
+        Returns:
+            False if the template no longer exists
+        """
+        await self.initialize()
+        
+        if not self.templates_container:
+            raise Exception("Cosmos DB Templates container not initialized")
+        
+        try:
+            await self.templates_container.replace_item(
+                item=template.id,
+                body=self._template_to_item(template)
+            )
+            return True
+        except exceptions.CosmosResourceNotFoundError:
+            return False
+    
+    async def seed_query_templates(self, templates: List[QueryTemplate]) -> bool:
+        """
+        Insert the built-in query templates once per database. A marker document
+        in the public partition records that seeding happened, so templates that
+        are later deleted stay deleted across restarts and scale-out.
+        
+        Returns:
+            True if the templates were seeded by this call, False if already done
+        """
+        await self.initialize()
+        
+        if not self.templates_container:
+            raise Exception("Cosmos DB Templates container not initialized")
+        
+        try:
+            await self.templates_container.read_item(
+                item=TEMPLATE_SEED_MARKER_ID,
+                partition_key=PUBLIC_TEMPLATE_PARTITION
+            )
+            return False
+        except exceptions.CosmosResourceNotFoundError:
+            pass
+        
+        # Several workers may get here at once on first start; create-if-absent
+        # makes that harmless. The marker is written last so a failed run retries.
+        for template in templates:
+            try:
+                await self.templates_container.create_item(body=self._template_to_item(template))
+            except exceptions.CosmosResourceExistsError:
+                pass
+        try:
+            await self.templates_container.create_item(body={
+                'id': TEMPLATE_SEED_MARKER_ID,
+                'userId': PUBLIC_TEMPLATE_PARTITION,
+                'type': 'template_seed_marker',
+                'seededAt': datetime.utcnow().isoformat()
+            })
+        except exceptions.CosmosResourceExistsError:
+            pass
+        return True
+    
+    async def get_query_template(self, template_id: str, user_id: Optional[str]) -> Optional[QueryTemplate]:
+        """Point-read a query template from its owner's partition (None for public templates)."""
+        await self.initialize()
+        
+        if not self.templates_container:
+            raise Exception("Cosmos DB Templates container not initialized")
+        
+        try:
+            item = await self.templates_container.read_item(
+                item=template_id,
+                partition_key=self._template_partition(user_id)
+            )
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        return QueryTemplate(**item)
+    
+    async def list_query_templates(self, user_id: Optional[str], category: Optional[str] = None) -> List[QueryTemplate]:
+        """List public query templates plus the user's own, optionally filtered by category."""
+        await self.initialize()
+        
+        if not self.templates_container:
+            raise Exception("Cosmos DB Templates container not initialized")
+        
+        query = "SELECT * FROM c WHERE c.type = 'query_template' AND c.userId IN (@public, @user_id)"
+        parameters = [
+            {"name": "@public", "value": PUBLIC_TEMPLATE_PARTITION},
+            {"name": "@user_id", "value": self._template_partition(user_id)}
+        ]
+        if category:
+            query += " AND c.category = @category"
+            parameters.append({"name": "@category", "value": category})
+        
+        templates = []
+        async for item in self.templates_container.query_items(
+            query=query,
+            parameters=parameters
+        ):
+            templates.append(QueryTemplate(**item))
+        return templates
+    
+    async def delete_query_template(self, template_id: str, user_id: Optional[str]) -> bool:
+        """Delete a query template from its owner's partition."""
+        await self.initialize()
+        
+        if not self.templates_container:
+            raise Exception("Cosmos DB Templates container not initialized")
+        
+        try:
+            await self.templates_container.delete_item(
+                item=template_id,
+                partition_key=self._template_partition(user_id)
+            )
+            return True
+        except exceptions.CosmosResourceNotFoundError:
+            return False
+    
     async def health_check(self) -> dict:
         """Perform a health check on Cosmos DB connection."""
         try:
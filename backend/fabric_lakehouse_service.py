@@ -3,23 +3,94 @@ Microsoft Fabric Lakehouse SQL query service.
 Executes SQL queries against Fabric Lakehouse using authenticated connections.
 """
 import asyncio
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Tuple, Union
 from azure.identity import DefaultAzureCredential, ManagedIdentityCredential, ClientSecretCredential, AzureCliCredential
-import struct
 import os
+import time
+import weakref
 import logging
 from config import FabricLakehouseSettings
 
 logger = logging.getLogger(__name__)
 
+# Environment markers are fixed for the lifetime of the process, so read them once.
+# Azure Container Apps sets CONTAINER_APP_NAME; ENVIRONMENT=development forces local mode.
+_ENVIRONMENT = os.getenv("ENVIRONMENT")
+_CONTAINER_APP_NAME = os.getenv("CONTAINER_APP_NAME")
+
+
+async def _keepalive_loop(service_ref: "weakref.ref[FabricLakehouseService]", interval: float):
+    """
+    Ping the connection while it sits idle so Fabric does not drop it.
+    A failed ping discards the connection and reconnects in the background,
+    so the next query does not pay re-auth + TLS on the request path.
+    Holds only a weak reference between iterations, so a service that is
+    never closed can still be collected (its finalizer closes the connection)
+    and the loop then exits.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        service = service_ref()
+        if service is None:
+            return
+        await service._keepalive_once(interval)
+        del service
+
+
+def _close_connection_silently(holder: list):
+    """Finalizer for a collected service: close its connection, if any, without logging."""
+    conn = holder[0]
+    holder[0] = None
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
 class FabricLakehouseService:
     """Service for executing SQL queries against Microsoft Fabric Lakehouse"""
     
     def __init__(self, config: FabricLakehouseSettings):
         self.config = config
-        self.connection = None
+        # The connection lives in a one-slot holder so the finalizer can close it
+        # without keeping a reference to the service itself.
+        self._connection_holder: list = [None]
+        weakref.finalize(self, _close_connection_silently, self._connection_holder)
         self._credential = None
+        self._token_struct: Optional[Tuple[str, bytes]] = None  # (raw token, packed ODBC struct)
+        self._connect_task: Optional[asyncio.Task] = None
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._last_used = 0.0
+        self._active_queries = 0  # queries currently running on the connection
+        self._inflight: Dict[tuple, asyncio.Future] = {}  # single-flight map for execute_query
+        
+        # Start connecting eagerly when constructed inside a running event loop
+        # (e.g. app startup) so auth + TLS overlap with the rest of startup and
+        # the first query only has to await the already in-flight connection.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            self._connect_task = loop.create_task(self.connect())
         
+    @property
+    def connection(self):
+        """Current pyodbc connection, or None when disconnected."""
+        return self._connection_holder[0]
+    
+    @connection.setter
+    def connection(self, value):
+        self._connection_holder[0] = value
+    
+    async def __aenter__(self):
+        """Connect on entry: ``async with FabricLakehouseService(cfg) as svc:``."""
+        await self._ensure_connected()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+    
     def _get_credential(self):
         """Get appropriate Azure credential based on configuration and environment detection"""
         if self._credential:
@@ -29,13 +100,12 @@ class FabricLakehouseService:
         # Azure Container Apps sets CONTAINER_APP_NAME environment variable
         # For local development, ENVIRONMENT can be set to "development"
         is_localhost = (
-            os.getenv("ENVIRONMENT") == "development" or
-            os.getenv("CONTAINER_APP_NAME") is None  # Azure Container Apps sets this
+            _ENVIRONMENT == "development" or
+            _CONTAINER_APP_NAME is None  # Azure Container Apps sets this
         )
         
-        logger.info(f"Fabric: Environment detection - is_localhost={is_localhost}, "
-                   f"ENVIRONMENT={os.getenv('ENVIRONMENT')}, "
-                   f"CONTAINER_APP_NAME={os.getenv('CONTAINER_APP_NAME')}")
+        logger.info("Fabric: Environment detection - is_localhost=%s, ENVIRONMENT=%s, CONTAINER_APP_NAME=%s",
+                    is_localhost, _ENVIRONMENT, _CONTAINER_APP_NAME)
         
         # Priority order:
         # 1. Service Principal (if client_id and client_secret provided)
@@ -58,6 +128,20 @@ class FabricLakehouseService:
             
         return self._credential
     
+    def _pack_token(self, token: str) -> bytes:
+        """
+        Pack an access token into the ODBC SQL_COPT_SS_ACCESS_TOKEN layout
+        (little-endian uint32 length + UTF-16-LE bytes), reusing the packed
+        bytes while the credential keeps returning the same token.
+        """
+        cached = self._token_struct
+        if cached is not None and cached[0] == token:
+            return cached[1]
+        token_bytes = token.encode("utf-16-le")
+        token_struct = len(token_bytes).to_bytes(4, "little") + token_bytes
+        self._token_struct = (token, token_struct)
+        return token_struct
+    
     def _connect_sync(self):
         """
         Synchronous connection helper — runs in a thread via asyncio.to_thread.
@@ -68,8 +152,7 @@ class FabricLakehouseService:
         credential = self._get_credential()
         token = credential.get_token("https://analysis.windows.net/powerbi/api/.default")
         
-        token_bytes = token.token.encode("utf-16-le")
-        token_struct = struct.pack(f'<I{len(token_bytes)}s', len(token_bytes), token_bytes)
+        token_struct = self._pack_token(token.token)
         SQL_COPT_SS_ACCESS_TOKEN = 1256
         
         server_name = self.config.endpoint.replace("https://", "").replace("http://", "")
@@ -82,14 +165,13 @@ class FabricLakehouseService:
             f"Connection Timeout={self.config.connection_timeout};"
         )
         
-        logger.info(f"Connecting to Fabric SQL endpoint:")
-        logger.info(f"  Server: {server_name}")
-        logger.info(f"  Database: {self.config.lakehouse_id}")
+        logger.info("Connecting to Fabric SQL endpoint: server=%s, database=%s",
+                    server_name, self.config.lakehouse_id)
         conn = pyodbc.connect(
             connection_string,
             attrs_before={SQL_COPT_SS_ACCESS_TOKEN: token_struct}
         )
-        logger.info(f"✓ Successfully connected to Fabric Lakehouse: {self.config.lakehouse_id}")
+        logger.info("✓ Successfully connected to Fabric Lakehouse: %s", self.config.lakehouse_id)
         return conn
 
     async def connect(self):
@@ -108,35 +190,142 @@ class FabricLakehouseService:
         
         try:
             self.connection = await asyncio.to_thread(self._connect_sync)
+            self._last_used = time.monotonic()
+            self._start_keepalive()
         except ImportError as e:
-            logger.error(f"Missing required package: {e}")
+            logger.error("Missing required package: %s", e)
             raise
         except Exception as e:
-            logger.error(f"Failed to connect to Fabric Lakehouse: {e}")
+            logger.error("Failed to connect to Fabric Lakehouse: %s", e)
             raise
     
-    def _execute_query_sync(self, query: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
+    def _start_keepalive(self):
+        """Start the background keepalive loop if enabled and not already running."""
+        if self.config.keepalive_interval <= 0:
+            return
+        if self._keepalive_task is None or self._keepalive_task.done():
+            self._keepalive_task = asyncio.create_task(
+                _keepalive_loop(weakref.ref(self), self.config.keepalive_interval)
+            )
+    
+    @staticmethod
+    def _ping_sync(conn):
+        """Run a trivial query on the given connection (runs in a thread)."""
+        cursor = conn.execute("SELECT 1")
+        cursor.fetchone()
+        cursor.close()
+    
+    async def _keepalive_once(self, interval: float):
+        """One keepalive check: ping the connection if it is idle, reconnect if the ping fails."""
+        conn = self.connection
+        # Never ping while a query is using the connection (long queries outlast
+        # the interval, and _last_used is only updated when they start and end)
+        if not conn or self._active_queries or time.monotonic() - self._last_used < interval:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.to_thread(self._ping_sync, conn),
+                timeout=self.config.connection_timeout
+            )
+            self._last_used = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # A query may have started during the ping; leave a busy (or already
+            # replaced) connection alone and let the query path surface any error
+            if self._active_queries or self.connection is not conn:
+                logger.warning("Fabric keepalive ping failed while the connection is in use: %s", e)
+                return
+            logger.warning("Fabric keepalive ping failed, reconnecting: %s", e)
+            self._discard_connection()
+            try:
+                await self.connect()
+            except Exception:
+                pass  # connect() already logged; the next query will retry
+    
+    async def _ensure_connected(self):
+        """
+        Make sure a connection is available, reusing the eager connect task
+        started in __init__ if it is still pending.
         """
-        Synchronous query helper — runs in a thread via asyncio.to_thread.
+        task = self._connect_task
+        if task is not None:
+            try:
+                await asyncio.shield(task)
+            finally:
+                if self._connect_task is task and task.done():
+                    self._connect_task = None
+        
+        if not self.connection:
+            await self.connect()
+    
+    def _fetch_sync(self, query: str, params: Optional[tuple] = None) -> Tuple[List[str], List[Any]]:
+        """
+        Synchronous fetch helper — runs in a thread via asyncio.to_thread.
         All blocking cursor operations happen here.
+        
+        Returns:
+            Tuple of (column names, raw pyodbc rows)
         """
         cursor = self.connection.cursor()
         self.connection.timeout = self.config.query_timeout
         
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        return columns, rows
+    
+    def _execute_query_sync(self, query: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        """Fetch rows and shape them as one dictionary per row."""
+        columns, rows = self._fetch_sync(query, params)
+        return [dict(zip(columns, row)) for row in rows]
+    
+    def _execute_query_columnar_sync(self, query: str, params: Optional[tuple] = None) -> Dict[str, List[Any]]:
+        """Fetch rows and transpose them into one list per column."""
+        columns, rows = self._fetch_sync(query, params)
+        if not rows:
+            return {column: [] for column in columns}
+        return dict(zip(columns, map(list, zip(*rows))))
+    
+    async def _run_query(self, fetch, query: str, params: Optional[tuple] = None):
+        """Ensure a connection, then run a sync fetch helper in a thread."""
+        await self._ensure_connected()
         
-        columns = [column[0] for column in cursor.description]
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return results
+        try:
+            self._last_used = time.monotonic()
+            # Count the query as active until its worker thread finishes, even if
+            # the awaiting caller is cancelled first (the thread keeps running)
+            self._active_queries += 1
+            task = asyncio.ensure_future(asyncio.to_thread(fetch, query, params))
+            task.add_done_callback(self._query_finished)
+            results = await asyncio.shield(task)
+            self._last_used = time.monotonic()
+            return results
+            
+        except Exception as e:
+            logger.error("Query execution failed: %s", e)
+            logger.error("Query: %s", query)
+            raise
+    
+    def _query_finished(self, task: asyncio.Future):
+        self._active_queries -= 1
+        self._last_used = time.monotonic()
+        if not task.cancelled():
+            task.exception()  # mark retrieved when the caller was cancelled
 
     async def execute_query(self, query: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
         """
         Execute SQL query and return results as list of dictionaries.
         Blocking pyodbc calls are offloaded to a thread.
+        Identical concurrent queries (same SQL and params) share one
+        in-flight execution and receive the same result list.
         
         Args:
             query: SQL query to execute
@@ -145,18 +334,44 @@ class FabricLakehouseService:
         Returns:
             List of dictionaries, one per row
         """
-        if not self.connection:
-            await self.connect()
-        
+        key = (query, params)
         try:
-            results = await asyncio.to_thread(self._execute_query_sync, query, params)
-            logger.info(f"Query executed successfully, returned {len(results)} rows")
-            return results
+            task = self._inflight.get(key)
+        except TypeError:
+            # Unhashable params cannot be coalesced; run the query directly
+            return await self._execute_query_once(query, params)
+        
+        if task is None:
+            task = asyncio.ensure_future(self._execute_query_once(query, params))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _task: self._inflight.pop(key, None))
+        
+        # Shield so one cancelled caller does not cancel the query for the others
+        return await asyncio.shield(task)
+    
+    async def _execute_query_once(self, query: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        """Run a single row-shaped query and log the row count."""
+        results = await self._run_query(self._execute_query_sync, query, params)
+        logger.info("Query executed successfully, returned %d rows", len(results))
+        return results
+    
+    async def execute_query_columnar(self, query: str, params: Optional[tuple] = None) -> Dict[str, List[Any]]:
+        """
+        Execute SQL query and return results column-wise.
+        Builds one list per column instead of one dict per row, which is
+        cheaper for aggregate/analytics callers that reduce over columns.
+        
+        Args:
+            query: SQL query to execute
+            params: Optional tuple of parameters for parameterized queries
             
-        except Exception as e:
-            logger.error(f"Query execution failed: {e}")
-            logger.error(f"Query: {query}")
-            raise
+        Returns:
+            Dictionary mapping column name to the list of values in that column
+        """
+        results = await self._run_query(self._execute_query_columnar_sync, query, params)
+        row_count = len(next(iter(results.values()))) if results else 0
+        logger.info("Columnar query executed successfully, returned %d rows", row_count)
+        return results
     
     async def execute_scalar(self, query: str, params: Optional[tuple] = None) -> Any:
         """
@@ -192,7 +407,7 @@ class FabricLakehouseService:
                 result = await self.execute_query(query)
                 results.append(result)
             except Exception as e:
-                logger.error(f"Query in batch failed: {e}")
+                logger.error("Query in batch failed: %s", e)
                 results.append([])  # Empty result for failed query
         return results
     
@@ -207,20 +422,26 @@ class FabricLakehouseService:
             result = await self.execute_scalar("SELECT 1 AS test")
             return result == 1
         except Exception as e:
-            logger.error(f"Connection test failed: {e}")
+            logger.error("Connection test failed: %s", e)
             return False
     
-    def close(self):
-        """Close database connection"""
+    def _discard_connection(self):
+        """Close the current connection without stopping background tasks."""
         if self.connection:
             try:
                 self.connection.close()
                 logger.info("Fabric Lakehouse connection closed")
             except Exception as e:
-                logger.error(f"Error closing connection: {e}")
+                logger.error("Error closing connection: %s", e)
             finally:
                 self.connection = None
-                
-    def __del__(self):
-        """Cleanup connection on object destruction"""
-        self.close()
+    
+    def close(self):
+        """Close database connection"""
+        if self._connect_task is not None:
+            self._connect_task.cancel()
+            self._connect_task = None
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        self._discard_connection()
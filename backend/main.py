@@ -41,14 +41,19 @@ if disable_ssl:
 else:
     print("ℹ️  SSL verification is ENABLED (secure mode)")
 
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Response
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
-from typing import Optional, Dict, List
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from pydantic import BaseModel, TypeAdapter
+from typing import Optional, Dict, List, Tuple
 import httpx
 import logging
-from jose import jwt, JWTError
+import jwt
+from jwt import PyJWK, InvalidTokenError
+from jwt.utils import base64url_decode
+import orjson
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -63,7 +68,8 @@ logging.getLogger("azure.identity").setLevel(logging.WARNING)
 logging.getLogger("azure.monitor.opentelemetry.exporter").setLevel(logging.WARNING)
 logging.getLogger("opentelemetry.sdk").setLevel(logging.WARNING)
 from functools import lru_cache
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from config import Settings
 from models import (
     QueryTemplate,
@@ -85,6 +91,8 @@ from cosmos_service import CosmosDBService
 from copilot_studio_service import CopilotStudioService
 from ai_foundry_service import AIFoundryService
 from conversation_service import ConversationService
+from query_template_service import QueryTemplateService
+from obo_token_cache import set_current_token_digest
 from powerbi_service import PowerBIService
 from visualization_service import visualization_service
 from rbac_service import RBACService
@@ -124,19 +132,31 @@ logger = logging.getLogger(__name__)
 for handler in logging.root.handlers:
     handler.setFormatter(IconFormatter('%(levelname)s:%(name)s:%(message)s'))
 
-# Initialize rate limiter
+# Initialize rate limiter (in-memory storage: limits are counted per worker process,
+# so with WEB_CONCURRENCY=N a client can make up to N times these rates)
 limiter = Limiter(key_func=get_remote_address, default_limits=["200/minute"])
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run startup before serving requests and always run cleanup on shutdown."""
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_event()
+
 # Initialize FastAPI app
-app = FastAPI(title="Call Center AI Insights API")
+# Serialize responses with orjson (C extension) instead of the stdlib json encoder
+app = FastAPI(
+    title="Call Center AI Insights API",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
 
 # Add rate limiter to app state
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# In-memory storage for query templates (replace with database in production)
-query_templates_db: Dict[str, QueryTemplate] = {}
-
 # Security scheme
 security = HTTPBearer()
 
@@ -145,6 +165,7 @@ cosmos_service: Optional[CosmosDBService] = None
 copilot_studio_service: Optional[CopilotStudioService] = None
 ai_foundry_service: Optional[AIFoundryService] = None
 conversation_service: Optional[ConversationService] = None
+query_template_service: Optional[QueryTemplateService] = None
 powerbi_service: Optional[PowerBIService] = None
 rbac_service: Optional[RBACService] = None
 fabric_service: Optional[FabricLakehouseService] = None
@@ -154,10 +175,9 @@ fabric_service: Optional[FabricLakehouseService] = None
 def get_settings():
     return Settings()
 
-@app.on_event("startup")
 async def startup_event():
     """Initialize services on startup with optimized cold-start performance."""
-    global cosmos_service, copilot_studio_service, ai_foundry_service, conversation_service, powerbi_service, fabric_service
+    global cosmos_service, copilot_studio_service, ai_foundry_service, conversation_service, query_template_service, powerbi_service, fabric_service
     settings = get_settings()
     startup_start = time.time()
     
@@ -181,6 +201,16 @@ async def startup_event():
         logger.warning("⚠ Cosmos DB account URI not configured - service will not be available")
     logger.info(f"⏱ Cosmos DB init: {(time.time() - t0) * 1000:.0f}ms")
     
+    # Without Cosmos, conversations, query templates and custom RBAC roles live in
+    # each worker's memory, so multiple workers would each see different data
+    web_concurrency = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if web_concurrency > 1 and not cosmos_service:
+        logger.error(
+            f"❌ WEB_CONCURRENCY={web_concurrency} without Cosmos DB: in-memory conversations, "
+            f"templates and roles are not shared between workers. Run a single worker "
+            f"(WEB_CONCURRENCY=1) or configure COSMOS_DB_ACCOUNT_URI."
+        )
+    
     # ── Phase 3: Synchronous service constructors (CPU-only, no I/O) ──
     t0 = time.time()
     
@@ -220,7 +250,13 @@ async def startup_event():
             powerbi_service = None
     
     # Initialize conversation service (works with or without Cosmos)
-    conversation_service = ConversationService(cosmos_service)
+    conversation_service = ConversationService(
+        cosmos_service,
+        list_cache_ttl=settings.CONVERSATION_LIST_CACHE_TTL
+    )
+    
+    # Initialize query template service (works with or without Cosmos)
+    query_template_service = QueryTemplateService(cosmos_service)
     
     # Initialize RBAC service
     global rbac_service
@@ -229,9 +265,12 @@ async def startup_event():
     
     logger.info(f"⏱ Sync service constructors: {(time.time() - t0) * 1000:.0f}ms")
     
-    # ── Phase 4: Parallel I/O — Fabric connection test + JWKS pre-warm ──
+    # ── Phase 4: Parallel I/O — Fabric connection test + JWKS pre-warm + template seeding ──
     t0 = time.time()
     
+    # Create the shared HTTP client up front so the JWKS pre-warm opens the pooled connection
+    _get_http_client()
+    
     # Prepare Fabric Lakehouse service (constructor is sync, test_connection is async)
     if settings.fabric_lakehouse and settings.fabric_lakehouse.is_configured():
         try:
@@ -263,8 +302,12 @@ async def startup_event():
         except Exception as e:
             logger.warning(f"⚠ JWKS pre-warm failed (will retry on first request): {e}")
     
-    await asyncio.gather(_fabric_test(), _jwks_prewarm())
-    logger.info(f"⏱ Parallel I/O (Fabric + JWKS): {(time.time() - t0) * 1000:.0f}ms")
+    await asyncio.gather(_fabric_test(), _jwks_prewarm(), query_template_service.initialize())
+    logger.info(f"⏱ Parallel I/O (Fabric + JWKS + templates): {(time.time() - t0) * 1000:.0f}ms")
+    
+    # Keep the JWKS fresh in the background so requests never wait on a refetch
+    global _jwks_refresh_task
+    _jwks_refresh_task = asyncio.create_task(_jwks_refresh_loop())
     
     total_ms = (time.time() - startup_start) * 1000
     logger.info(f"⏱ Total startup time: {total_ms:.0f}ms")
@@ -311,14 +354,19 @@ def _configure_app_insights(settings) -> None:
         except Exception as e:
             logger.warning(f"⚠ Could not configure Application Insights tracing: {e}")
 
-@app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown."""
     global cosmos_service, fabric_service
+    if _jwks_refresh_task:
+        _jwks_refresh_task.cancel()
+    if _http_client:
+        await _http_client.aclose()
     if cosmos_service:
         await cosmos_service.close()
     if fabric_service:
         fabric_service.close()
+    if powerbi_service:
+        await powerbi_service.close()
 
 # CORS configuration
 settings = get_settings()
@@ -328,160 +376,368 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["x-continuation-token"],
 )
 
-# Security headers middleware
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    """Add security headers to all responses."""
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    response.headers["Content-Security-Policy"] = "default-src 'self'; frame-ancestors 'none';"
-    response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-    response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
-    return response
-
-# Audit logging middleware
-@app.middleware("http")
-async def audit_middleware(request: Request, call_next):
-    """Log all API requests for audit purposes."""
-    start_time = time.time()
-    
-    # Extract user info from token if present
-    auth_header = request.headers.get("authorization", "")
-    user_id = "anonymous"
-    user_email = "anonymous"
-    
-    if auth_header.startswith("Bearer "):
+# Security headers added to every response, pre-encoded once as ASGI header pairs
+_SECURITY_HEADERS = [
+    (name.lower().encode("latin-1"), value.encode("latin-1"))
+    for name, value in (
+        ("X-Content-Type-Options", "nosniff"),
+        ("X-Frame-Options", "DENY"),
+        ("X-XSS-Protection", "1; mode=block"),
+        ("Strict-Transport-Security", "max-age=31536000; includeSubDomains"),
+        ("Content-Security-Policy", "default-src 'self'; frame-ancestors 'none';"),
+        ("Referrer-Policy", "strict-origin-when-cross-origin"),
+        ("Permissions-Policy", "geolocation=(), microphone=(), camera=()"),
+    )
+]
+_SECURITY_HEADER_NAMES = frozenset(name for name, _ in _SECURITY_HEADERS)
+
+class SecurityHeadersAuditMiddleware:
+    """
+    Pure ASGI middleware that adds the security headers to all responses and
+    logs every API request for audit purposes. Replaces two stacked
+    @app.middleware("http") functions, each of which ran the request through
+    BaseHTTPMiddleware's extra task and response-streaming machinery.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.time()
+        status_code = 500
+        
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = [
+                    header for header in message.get("headers", [])
+                    if header[0].lower() not in _SECURITY_HEADER_NAMES
+                ]
+                headers.extend(_SECURITY_HEADERS)
+                message["headers"] = headers
+            await send(message)
+        
         try:
-            token = auth_header.split(" ")[1]
-            payload = jwt.get_unverified_claims(token)
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            self._audit(scope, status_code, (time.time() - start_time) * 1000)
+    
+    @staticmethod
+    def _audit(scope: Scope, status_code: int, duration_ms: float) -> None:
+        # Extract user info from the verified token payload (set by verify_token
+        # on request.state, which lives in the scope); only decode the raw token
+        # for requests that never reached verification
+        user_id = "anonymous"
+        user_email = "anonymous"
+        
+        payload = scope.get("state", {}).get("token_payload")
+        if payload is None:
+            for name, value in scope.get("headers", ()):
+                if name == b"authorization":
+                    auth_header = value.decode("latin-1")
+                    if auth_header.startswith("Bearer "):
+                        try:
+                            token = auth_header.split(" ")[1]
+                            _, payload = _decode_unverified(token)
+                        except Exception:
+                            pass
+                    break
+        if payload is not None:
             user_id = payload.get("oid", "unknown")
             user_email = payload.get("preferred_username") or payload.get("email", "unknown")
-        except:
-            pass
-    
-    # Process request
-    response = await call_next(request)
-    
-    # Calculate duration
-    duration_ms = (time.time() - start_time) * 1000
-    
-    # Log the request
-    logger.info(
-        f"API_AUDIT: {request.method} {request.url.path} - "
-        f"User: {user_email} ({user_id}) - "
-        f"IP: {request.client.host if request.client else 'unknown'} - "
-        f"Status: {response.status_code} - "
-        f"Duration: {duration_ms:.2f}ms"
-    )
-    
-    return response
+        
+        client = scope.get("client")
+        
+        # Log the request
+        logger.info(
+            f"API_AUDIT: {scope['method']} {scope['path']} - "
+            f"User: {user_email} ({user_id}) - "
+            f"IP: {client[0] if client else 'unknown'} - "
+            f"Status: {status_code} - "
+            f"Duration: {duration_ms:.2f}ms"
+        )
+
+app.add_middleware(SecurityHeadersAuditMiddleware)
 
 # Cache for JWKS (JSON Web Key Set) with TTL
+# Expiry honours the Cache-Control max-age sent by Entra ID (clamped to a sane
+# range); a background task refreshes ahead of expiry so requests never block on it.
 _jwks_cache: Optional[Dict] = None
-_jwks_cache_time: float = 0.0
-_JWKS_CACHE_TTL: float = 24 * 60 * 60  # 24 hours
+_jwks_by_kid: Dict[str, object] = {}  # kid -> pre-constructed RS256 public key
+# Header segments of tokens that verified against the current key set. Entra ID
+# emits one header per signing key, so this stays tiny and lets the common case
+# skip base64 + JSON decoding of the header. Cleared whenever the keys change.
+_known_jwt_headers: Dict[str, Dict] = {}
+_KNOWN_JWT_HEADERS_MAX = 32
+_jwks_expires_at: float = 0.0  # time.monotonic() deadline
+_jwks_fetched_at: float = 0.0  # time.monotonic() of the last successful fetch/revalidation
+_jwks_etag: Optional[str] = None
+_jwks_last_modified: Optional[str] = None
+_jwks_lock = asyncio.Lock()
+_jwks_refresh_task: Optional[asyncio.Task] = None
+_JWKS_DEFAULT_TTL: float = 60 * 60  # 1 hour when no max-age is sent
+_JWKS_MIN_TTL: float = 5 * 60  # 5 minutes
+_JWKS_MAX_TTL: float = 24 * 60 * 60  # 24 hours
+_JWKS_REFRESH_MARGIN: float = 30.0  # refresh this many seconds before expiry
+_JWKS_FAILURE_RETRY: float = 60.0  # serve last-good keys this long after a failed fetch
+_JWKS_FORCED_REFRESH_INTERVAL: float = 30.0  # min spacing between forced (key-miss) refreshes
+
+# Entra ID key endpoint and accepted token issuers/audiences, formatted once
+# rather than on every request
+_JWKS_URL = f"https://login.microsoftonline.com/{settings.ENTRA_TENANT_ID}/discovery/v2.0/keys"
+_TOKEN_ISSUERS = [
+    f"https://sts.windows.net/{settings.ENTRA_TENANT_ID}/",  # v1.0 tokens
+    f"https://login.microsoftonline.com/{settings.ENTRA_TENANT_ID}/v2.0",  # v2.0 tokens
+]
+_TOKEN_AUDIENCES = [
+    f"api://{settings.ENTRA_CLIENT_ID}",  # most common for exposed APIs
+    settings.ENTRA_CLIENT_ID,
+]
+
+# Shared HTTP client so JWKS fetches reuse pooled keep-alive connections
+# to login.microsoftonline.com instead of paying TCP + TLS on every refresh
+_http_client: Optional[httpx.AsyncClient] = None
 
 # Token validation cache (to reduce JWT validation overhead)
-from cachetools import TTLCache
-_token_validation_cache = TTLCache(maxsize=1000, ttl=300)  # 5 minute TTL
+# Entries live until the token's own exp (minus a small skew), capped at 1 hour
+from cachetools import TLRUCache, TTLCache
+_TOKEN_CACHE_EXP_SKEW: float = 5.0  # drop cached tokens this many seconds before exp
+_TOKEN_CACHE_MAX_TTL: float = 60 * 60  # 1 hour
+
+def _token_cache_ttu(_key, payload: Dict, now: float) -> float:
+    """Expire a cached payload at its exp claim, never later than the max TTL."""
+    exp = payload.get("exp")
+    expires_at = now + _TOKEN_CACHE_MAX_TTL
+    if isinstance(exp, (int, float)):
+        expires_at = min(expires_at, exp - _TOKEN_CACHE_EXP_SKEW)
+    return expires_at
+
+_token_validation_cache = TLRUCache(maxsize=4096, ttu=_token_cache_ttu, timer=time.time)
+
+# Recently rejected tokens (digest -> error message), so a client retrying with an
+# expired or invalid token is refused without re-verifying the signature. Only
+# token errors are recorded; JWKS/network failures and not-yet-valid (nbf)
+# tokens are always re-checked.
+_token_rejection_cache = TTLCache(maxsize=1024, ttl=30)
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            verify=not get_settings().DISABLE_SSL_VERIFY,
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=10)
+        )
+    return _http_client
+
+def _index_jwks(jwks: Dict) -> Dict[str, object]:
+    """Build the kid -> public key index once per JWKS refresh."""
+    keys_by_kid = {}
+    for key in jwks.get("keys", []):
+        try:
+            keys_by_kid[key["kid"]] = PyJWK({
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "use": key.get("use"),
+                "n": key["n"],
+                "e": key["e"]
+            }, algorithm="RS256").key
+        except Exception as e:
+            logger.warning(f"Skipping unusable JWKS key {key.get('kid')}: {e}")
+    return keys_by_kid
+
+def _jwks_ttl_from_headers(headers) -> float:
+    """Derive the JWKS cache lifetime from the response's Cache-Control max-age."""
+    for directive in headers.get("cache-control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name.lower() == "max-age":
+            try:
+                return min(max(float(value), _JWKS_MIN_TTL), _JWKS_MAX_TTL)
+            except ValueError:
+                break
+    return _JWKS_DEFAULT_TTL
 
-async def get_jwks(force_refresh: bool = False) -> Dict:
+async def _refresh_jwks(force_refresh: bool = False) -> Dict:
     """
-    Fetch JSON Web Key Set from Microsoft Entra ID.
-    Implements caching with a 24-hour TTL and supports forced refresh
-    when a signing key is not found (Microsoft rotates keys).
+    Fetch the JWKS from Entra ID, revalidating with ETag / Last-Modified when
+    a cached copy exists. Must be called with _jwks_lock held.
+    Falls back to the last-good key set if the fetch fails.
     """
-    global _jwks_cache, _jwks_cache_time
+    global _jwks_cache, _jwks_by_kid, _jwks_expires_at, _jwks_fetched_at, _jwks_etag, _jwks_last_modified
     
-    now = time.time()
-    if not force_refresh and _jwks_cache is not None and (now - _jwks_cache_time) < _JWKS_CACHE_TTL:
-        return _jwks_cache
-    
-    settings = get_settings()
-    jwks_url = f"https://login.microsoftonline.com/{settings.ENTRA_TENANT_ID}/discovery/v2.0/keys"
-    
-    # Check if SSL verification should be disabled
-    verify_ssl = not settings.DISABLE_SSL_VERIFY
+    headers = {}
+    if _jwks_cache is not None:
+        if _jwks_etag:
+            headers["If-None-Match"] = _jwks_etag
+        if _jwks_last_modified:
+            headers["If-Modified-Since"] = _jwks_last_modified
     
     try:
-        async with httpx.AsyncClient(verify=verify_ssl) as client:
-            response = await client.get(jwks_url, timeout=10.0)
-            response.raise_for_status()
-            _jwks_cache = response.json()
-            _jwks_cache_time = now
-            logger.info("JWKS cache refreshed" + (" (forced)" if force_refresh else ""))
+        response = await _get_http_client().get(_JWKS_URL, headers=headers)
+        now = time.monotonic()
+        if response.status_code == 304 and _jwks_cache is not None:
+            _jwks_expires_at = now + _jwks_ttl_from_headers(response.headers)
+            _jwks_fetched_at = now
+            logger.debug("JWKS cache revalidated (not modified)")
             return _jwks_cache
+        response.raise_for_status()
+        _jwks_cache = response.json()
+        _jwks_by_kid = _index_jwks(_jwks_cache)
+        _known_jwt_headers.clear()
+        _jwks_expires_at = now + _jwks_ttl_from_headers(response.headers)
+        _jwks_fetched_at = now
+        _jwks_etag = response.headers.get("etag")
+        _jwks_last_modified = response.headers.get("last-modified")
+        logger.info("JWKS cache refreshed" + (" (forced)" if force_refresh else ""))
+        return _jwks_cache
     except Exception as e:
         logger.error(f"Failed to fetch JWKS: {e}")
         if "CERTIFICATE_VERIFY_FAILED" in str(e) or "certificate" in str(e).lower():
             logger.error("💡 SSL certificate error detected. If behind a corporate proxy, set DISABLE_SSL_VERIFY=true in .env")
+        if _jwks_cache is not None:
+            # Fail open to the last-good key set and retry shortly
+            logger.warning("Serving last-good JWKS after refresh failure")
+            _jwks_expires_at = time.monotonic() + _JWKS_FAILURE_RETRY
+            return _jwks_cache
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to fetch signing keys"
         )
 
+async def get_jwks(force_refresh: bool = False) -> Dict:
+    """
+    Fetch JSON Web Key Set from Microsoft Entra ID.
+    Serves the cached key set until it expires; only one coroutine refetches
+    at a time. Supports forced refresh when a signing key is not found
+    (Microsoft rotates keys), rate-limited so unknown kids cannot cause a
+    refetch storm.
+    """
+    if not force_refresh and _jwks_cache is not None and time.monotonic() < _jwks_expires_at:
+        return _jwks_cache
+    
+    async with _jwks_lock:
+        # Another coroutine may have refreshed while we waited for the lock
+        now = time.monotonic()
+        if _jwks_cache is not None:
+            if not force_refresh and now < _jwks_expires_at:
+                return _jwks_cache
+            if force_refresh and now - _jwks_fetched_at < _JWKS_FORCED_REFRESH_INTERVAL:
+                return _jwks_cache
+        return await _refresh_jwks(force_refresh)
+
+async def _jwks_refresh_loop():
+    """Background task: refresh the JWKS shortly before it expires."""
+    while True:
+        delay = max(_jwks_expires_at - time.monotonic() - _JWKS_REFRESH_MARGIN, 1.0)
+        await asyncio.sleep(delay)
+        try:
+            async with _jwks_lock:
+                await _refresh_jwks()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Background JWKS refresh failed: {e}")
+            await asyncio.sleep(_JWKS_FAILURE_RETRY)
+
+def _decode_unverified_header(token: str) -> Dict:
+    """
+    Decode a compact JWT's header without verifying the signature, reusing
+    the already-parsed header for tokens signed by a known key.
+    """
+    header_b64 = token.partition(".")[0]
+    header = _known_jwt_headers.get(header_b64)
+    if header is None:
+        try:
+            header = orjson.loads(base64url_decode(header_b64.encode("ascii")))
+        except (ValueError, TypeError, UnicodeError) as e:
+            raise jwt.DecodeError(f"Malformed token: {e}")
+        if not isinstance(header, dict):
+            raise jwt.DecodeError("Malformed token: header must be a JSON object")
+    return header
+
+def _decode_unverified(token: str) -> Tuple[Dict, Dict]:
+    """
+    Decode a compact JWT's header and claims in a single pass, without
+    verifying the signature. Replaces separate get_unverified_header /
+    get_unverified_claims calls, which each re-split and re-decode the token.
+    """
+    header = _decode_unverified_header(token)
+    try:
+        claims_b64 = token.split(".", 2)[1]
+        claims = orjson.loads(base64url_decode(claims_b64.encode("ascii")))
+    except (IndexError, ValueError, TypeError, UnicodeError) as e:
+        raise jwt.DecodeError(f"Malformed token: {e}")
+    if not isinstance(claims, dict):
+        raise jwt.DecodeError("Malformed token: claims must be a JSON object")
+    return header, claims
+
 async def verify_token(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> Dict:
     """
     Verify JWT access token from Microsoft Entra ID with caching.
     
     Steps:
-    1. Check cache for previously validated token
-    2. Extract token from Authorization header
+    1. Reuse the payload if this request was already verified
+    2. Check cache for previously validated token
     3. Fetch JWKS from Microsoft
     4. Validate token signature and claims
     5. Cache validation result
-    6. Return decoded token payload
+    6. Return decoded token payload (also stored on request.state.token_payload)
     """
+    payload = getattr(request.state, "token_payload", None)
+    if payload is not None:
+        return payload
+    
     token = credentials.credentials
-    settings = get_settings()
     
     # Check cache first
-    token_hash = hashlib.sha256(token.encode()).hexdigest()
-    if token_hash in _token_validation_cache:
+    token_hash = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    set_current_token_digest(token, token_hash)
+    cached_payload = _token_validation_cache.get(token_hash)
+    if cached_payload is not None:
         logger.debug("Token validation cache hit")
-        return _token_validation_cache[token_hash]
+        request.state.token_payload = cached_payload
+        return cached_payload
+    
+    rejection = _token_rejection_cache.get(token_hash)
+    if rejection is not None:
+        logger.debug("Token rejection cache hit")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid authentication credentials: {rejection}",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
     try:
-        # Get signing keys
-        jwks = await get_jwks()
+        # Make sure signing keys are loaded
+        await get_jwks()
         
-        # Decode token header to get the key ID
-        unverified_header = jwt.get_unverified_header(token)
+        # Decode only the token header; reject unexpected algorithms before
+        # touching the key set (claims are parsed once, by jwt.decode)
+        unverified_header = _decode_unverified_header(token)
+        if unverified_header.get("alg") != "RS256":
+            raise jwt.InvalidAlgorithmError("Unsupported token signing algorithm")
+        kid = unverified_header.get("kid")
         
         # Find the correct signing key
-        rsa_key = None
-        for key in jwks.get("keys", []):
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
-                break
+        rsa_key = _jwks_by_kid.get(kid)
         
         # Key-miss: Microsoft may have rotated keys — refresh JWKS and retry once
         if rsa_key is None:
-            logger.warning(f"Signing key {unverified_header['kid']} not in cache, forcing JWKS refresh")
-            jwks = await get_jwks(force_refresh=True)
-            for key in jwks.get("keys", []):
-                if key["kid"] == unverified_header["kid"]:
-                    rsa_key = {
-                        "kty": key["kty"],
-                        "kid": key["kid"],
-                        "use": key["use"],
-                        "n": key["n"],
-                        "e": key["e"]
-                    }
-                    break
+            logger.warning("Signing key %s not in cache, forcing JWKS refresh", kid)
+            await get_jwks(force_refresh=True)
+            rsa_key = _jwks_by_kid.get(kid)
         
         if rsa_key is None:
             raise HTTPException(
@@ -489,68 +745,50 @@ async def verify_token(
                 detail="Unable to find appropriate signing key"
             )
         
-        # First, decode without verification to see what's in the token
-        unverified_payload = jwt.get_unverified_claims(token)
-        
-        # Accept both v1.0 and v2.0 token issuers
-        v1_issuer = f"https://sts.windows.net/{settings.ENTRA_TENANT_ID}/"
-        v2_issuer = f"https://login.microsoftonline.com/{settings.ENTRA_TENANT_ID}/v2.0"
-        
-        # Determine which issuer to use based on the token
-        token_issuer = unverified_payload.get('iss')
-        expected_issuer = v1_issuer if token_issuer == v1_issuer else v2_issuer
-        
-        # Try to decode with the api:// prefixed audience first
-        api_audience = f"api://{settings.ENTRA_CLIENT_ID}"
-        
-        try:
-            # Try with api:// prefix first (most common for exposed APIs)
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=["RS256"],
-                audience=api_audience,
-                issuer=expected_issuer
-            )
-        except JWTError as e:
-            # Fallback to client ID without prefix
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=["RS256"],
-                audience=settings.ENTRA_CLIENT_ID,
-                issuer=expected_issuer
-            )
+        # Accept v1.0 and v2.0 issuers and both audience forms in a single
+        # decode, so the signature is verified exactly once
+        payload = jwt.decode(
+            token,
+            rsa_key,
+            algorithms=["RS256"],
+            audience=_TOKEN_AUDIENCES,
+            issuer=_TOKEN_ISSUERS
+        )
         
-        # Cache the validated token
+        # Cache the validated token, and its header for the decode fast path
         _token_validation_cache[token_hash] = payload
+        if len(_known_jwt_headers) < _KNOWN_JWT_HEADERS_MAX:
+            _known_jwt_headers[token.partition(".")[0]] = unverified_header
         logger.debug("Token validated and cached")
         
+        request.state.token_payload = payload
         return payload
         
-    except JWTError as e:
-        logger.error(f"JWT validation error: {e}")
+    except InvalidTokenError as e:
+        logger.error("JWT validation error: %s", e)
+        if not isinstance(e, jwt.ImmatureSignatureError):
+            _token_rejection_cache[token_hash] = str(e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid authentication credentials: {str(e)}",
             headers={"WWW-Authenticate": "Bearer"},
         )
     except Exception as e:
-        logger.error(f"Token verification error: {e}")
+        logger.error("Token verification error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
 
 # RBAC helper functions
+_VALID_APP_ROLES = frozenset({"Administrator", "Contributor", "Reader"})
+
 async def get_user_permissions(token_payload: Dict = Depends(verify_token)) -> UserPermissions:
     """
     Get user permissions from token payload.
     This is a dependency that can be used in endpoints.
     Raises 403 if user has no roles assigned.
     """
-    settings = get_settings()
-    
     # Development mode: Bypass RBAC if DISABLE_RBAC is true
     if settings.DISABLE_RBAC:
         logger.warning("⚠️  RBAC DISABLED - Development mode: Granting Administrator role to all authenticated users")
@@ -571,12 +809,11 @@ async def get_user_permissions(token_payload: Dict = Depends(verify_token)) -> U
     
     user_permissions = await rbac_service.get_user_permissions(token_payload)
     
-    # Debug logging
-    logger.info(f"DEBUG: User {user_permissions.user_email} has roles: {user_permissions.roles}")
+    # Debug logging (lazy %-formatting: skipped entirely unless DEBUG is enabled)
+    logger.debug("User %s has roles: %s", user_permissions.user_email, user_permissions.roles)
     
     # Check if user has any VALID APP ROLES (not just OAuth scopes like 'access_as_user')
-    valid_app_roles = {"Administrator", "Contributor", "Reader"}
-    user_app_roles = set(user_permissions.roles) & valid_app_roles
+    user_app_roles = _VALID_APP_ROLES.intersection(user_permissions.roles)
     
     if not user_app_roles:
         logger.warning(f"Access denied for user {user_permissions.user_email}: No valid app roles assigned (has: {user_permissions.roles})")
@@ -601,6 +838,21 @@ def require_permission(required_permission: Permission):
         return user_permissions
     return permission_checker
 
+def require_user_permission(required_permission: Permission):
+    """
+    Like require_permission, but also rejects tokens without a user ID (400),
+    so per-user endpoints can use user_permissions.user_id directly.
+    """
+    permission_checker = require_permission(required_permission)
+    async def user_checker(user_permissions: UserPermissions = Depends(permission_checker)):
+        if not user_permissions.user_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="User ID not found in token"
+            )
+        return user_permissions
+    return user_checker
+
 def require_any_permission(required_permissions: List[Permission]):
     """
     Dependency factory to require any of the specified permissions.
@@ -704,20 +956,48 @@ async def get_feature_config():
     
     return {"features": features}
 
+def _compute_etag(body: bytes) -> str:
+    """Strong ETag (quoted content hash) for a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def _etag_json_response(
+    request: Request,
+    body: bytes,
+    cache_control: str = "private, no-cache",
+    etag: Optional[str] = None
+) -> Response:
+    """
+    JSON response with a content-hash ETag. A matching If-None-Match gets an
+    empty 304 instead of the body. By default clients must revalidate (no-cache).
+    Pass etag for bodies that are reused, so the hash is not recomputed per request.
+    """
+    if etag is None:
+        etag = _compute_etag(body)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Dashboard data is shared by all users and refreshed at most per minute
+_DASHBOARD_CACHE_CONTROL = "private, max-age=30"
+
 # Protected endpoints
 @app.get("/api/user/profile")
-async def get_user_profile(token_payload: Dict = Depends(verify_token)):
+async def get_user_profile(request: Request, token_payload: Dict = Depends(verify_token)):
     """
     Get user profile information from the validated token.
     This endpoint is protected and requires valid authentication.
     """
-    return {
+    profile = {
         "user_id": token_payload.get("oid"),  # Object ID
         "email": token_payload.get("preferred_username") or token_payload.get("email"),
         "name": token_payload.get("name"),
         "tenant_id": token_payload.get("tid"),
         "roles": token_payload.get("roles", []),
     }
+    # Revalidated rather than max-age: the profile is per signed-in user
+    return _etag_json_response(request, orjson.dumps(profile))
 
 @app.get("/api/user/permissions")
 async def get_current_user_permissions(
@@ -736,8 +1016,117 @@ async def get_current_user_permissions(
         "is_administrator": user_permissions.is_administrator,
     }
 
+# Static dashboard payloads, encoded once at import time.
+# Default mock KPIs (used if Fabric service is unavailable)
+_DEFAULT_KPIS = [
+    {
+        "id": "total-calls",
+        "title": "Total Call Volume",
+        "subtitle": "Total calls today",
+        "icon": "Phone",
+        "color": "primary.main",
+        "value": "1,543",
+        "rawValue": 1543,
+        "trend": {"value": 8.5, "isPositive": True},
+        "order": 1
+    },
+    {
+        "id": "avg-handling-time",
+        "title": "Avg Handling Time",
+        "subtitle": "Minutes per call",
+        "icon": "AccessTime",
+        "color": "info.main",
+        "value": "5:32",
+        "rawValue": 332,
+        "trend": {"value": 3.2, "isPositive": False},
+        "order": 2
+    },
+    {
+        "id": "customer-satisfaction",
+        "title": "Customer Satisfaction",
+        "subtitle": "Average rating",
+        "icon": "SentimentSatisfied",
+        "color": "success.main",
+        "value": "4.5/5",
+        "rawValue": 4.5,
+        "trend": {"value": 5.1, "isPositive": True},
+        "order": 3
+    },
+    {
+        "id": "agent-availability",
+        "title": "Agent Availability",
+        "subtitle": "Currently available",
+        "icon": "People",
+        "color": "warning.main",
+        "value": "87%",
+        "rawValue": 87,
+        "trend": {"value": 2.3, "isPositive": True},
+        "order": 4
+    },
+    {
+        "id": "escalation-rate",
+        "title": "Escalation Rate",
+        "subtitle": "Escalated to supervisor",
+        "icon": "TrendingUp",
+        "color": "error.main",
+        "value": "12.3%",
+        "rawValue": 12.3,
+        "trend": {"value": 1.8, "isPositive": False},
+        "order": 5
+    }
+]
+_DEFAULT_KPIS_JSON = orjson.dumps({"kpis": _DEFAULT_KPIS})
+_DEFAULT_KPIS_ETAG = _compute_etag(_DEFAULT_KPIS_JSON)
+
+# Mock chart data for the dashboard
+_DASHBOARD_CHARTS = {
+    "callVolumeTrend": [
+        {"date": "Mon", "calls": 245, "answered": 230},
+        {"date": "Tue", "calls": 278, "answered": 265},
+        {"date": "Wed", "calls": 312, "answered": 298},
+        {"date": "Thu", "calls": 289, "answered": 275},
+        {"date": "Fri", "calls": 335, "answered": 320},
+        {"date": "Sat", "calls": 198, "answered": 185},
+        {"date": "Sun", "calls": 156, "answered": 148},
+    ],
+    "callsByHour": [
+        {"hour": "8 AM", "calls": 45},
+        {"hour": "9 AM", "calls": 78},
+        {"hour": "10 AM", "calls": 95},
+        {"hour": "11 AM", "calls": 112},
+        {"hour": "12 PM", "calls": 98},
+        {"hour": "1 PM", "calls": 85},
+        {"hour": "2 PM", "calls": 102},
+        {"hour": "3 PM", "calls": 118},
+        {"hour": "4 PM", "calls": 95},
+        {"hour": "5 PM", "calls": 67},
+    ],
+    "satisfactionBreakdown": [
+        {"name": "Excellent (5)", "value": 45},
+        {"name": "Good (4)", "value": 32},
+        {"name": "Average (3)", "value": 15},
+        {"name": "Poor (2)", "value": 6},
+        {"name": "Very Poor (1)", "value": 2},
+    ],
+    "agentPerformance": [
+        {"agent": "Sarah Miller", "calls": 89, "avgTime": 4.5, "satisfaction": 4.8},
+        {"agent": "John Davis", "calls": 82, "avgTime": 5.2, "satisfaction": 4.6},
+        {"agent": "Emily Chen", "calls": 78, "avgTime": 4.8, "satisfaction": 4.7},
+        {"agent": "Michael Brown", "calls": 75, "avgTime": 5.5, "satisfaction": 4.5},
+        {"agent": "Lisa Anderson", "calls": 71, "avgTime": 5.0, "satisfaction": 4.6},
+    ],
+}
+_DASHBOARD_CHARTS_JSON = orjson.dumps(_DASHBOARD_CHARTS)
+_DASHBOARD_CHARTS_ETAG = _compute_etag(_DASHBOARD_CHARTS_JSON)
+
+# Encoded KPI response from Fabric, reused for polls within the TTL
+# (the CurrentKPI table is refreshed per day, dashboards poll far more often)
+_KPI_RESPONSE_TTL: float = 60.0
+_kpi_response_cache: Optional[Tuple[float, bytes, str]] = None  # (time.monotonic() expiry, body, ETag)
+
 @app.get("/api/dashboard/kpis")
 async def get_dashboard_kpis(
+    request: Request,
     user_permissions: UserPermissions = Depends(require_permission(Permission.DASHBOARD_VIEW))
 ):
     """
@@ -750,67 +1139,14 @@ async def get_dashboard_kpis(
     Fetches all KPIs for today's date in a single query
     """
     
-    # Default mock KPIs (used if Fabric service is unavailable)
-    default_kpis = [
-        {
-            "id": "total-calls",
-            "title": "Total Call Volume",
-            "subtitle": "Total calls today",
-            "icon": "Phone",
-            "color": "primary.main",
-            "value": "1,543",
-            "rawValue": 1543,
-            "trend": {"value": 8.5, "isPositive": True},
-            "order": 1
-        },
-        {
-            "id": "avg-handling-time",
-            "title": "Avg Handling Time",
-            "subtitle": "Minutes per call",
-            "icon": "AccessTime",
-            "color": "info.main",
-            "value": "5:32",
-            "rawValue": 332,
-            "trend": {"value": 3.2, "isPositive": False},
-            "order": 2
-        },
-        {
-            "id": "customer-satisfaction",
-            "title": "Customer Satisfaction",
-            "subtitle": "Average rating",
-            "icon": "SentimentSatisfied",
-            "color": "success.main",
-            "value": "4.5/5",
-            "rawValue": 4.5,
-            "trend": {"value": 5.1, "isPositive": True},
-            "order": 3
-        },
-        {
-            "id": "agent-availability",
-            "title": "Agent Availability",
-            "subtitle": "Currently available",
-            "icon": "People",
-            "color": "warning.main",
-            "value": "87%",
-            "rawValue": 87,
-            "trend": {"value": 2.3, "isPositive": True},
-            "order": 4
-        },
-        {
-            "id": "escalation-rate",
-            "title": "Escalation Rate",
-            "subtitle": "Escalated to supervisor",
-            "icon": "TrendingUp",
-            "color": "error.main",
-            "value": "12.3%",
-            "rawValue": 12.3,
-            "trend": {"value": 1.8, "isPositive": False},
-            "order": 5
-        }
-    ]
+    global _kpi_response_cache
     
     # If Fabric service is available, fetch real data from CurrentKPI table
     if fabric_service:
+        if _kpi_response_cache is not None and time.monotonic() < _kpi_response_cache[0]:
+            _, body, etag = _kpi_response_cache
+            return _etag_json_response(request, body, _DASHBOARD_CACHE_CONTROL, etag)
+        
         try:
             logger.info("Fetching KPIs from Fabric Lakehouse CurrentKPI table...")
             # Single query to fetch all KPIs for today
@@ -859,7 +1195,10 @@ async def get_dashboard_kpis(
                     kpis.append(kpi)
                 
                 logger.info(f"Dashboard KPIs fetched from Fabric Lakehouse CurrentKPI table: {len(kpis)} KPIs")
-                return {"kpis": kpis}
+                body = orjson.dumps({"kpis": kpis})
+                etag = _compute_etag(body)
+                _kpi_response_cache = (time.monotonic() + _KPI_RESPONSE_TTL, body, etag)
+                return _etag_json_response(request, body, _DASHBOARD_CACHE_CONTROL, etag)
             else:
                 logger.warning("No KPI data found in CurrentKPI table for today, using mock data")
                 
@@ -870,10 +1209,11 @@ async def get_dashboard_kpis(
         logger.debug("Fabric service not available, using mock data")
     
     # Return default mock data as fallback
-    return {"kpis": default_kpis}
+    return _etag_json_response(request, _DEFAULT_KPIS_JSON, _DASHBOARD_CACHE_CONTROL, _DEFAULT_KPIS_ETAG)
 
 @app.get("/api/dashboard/charts")
 async def get_dashboard_charts(
+    request: Request,
     user_permissions: UserPermissions = Depends(require_permission(Permission.DASHBOARD_VIEW))
 ):
     """
@@ -881,43 +1221,7 @@ async def get_dashboard_charts(
     Returns mock data for charts and visualizations.
     Requires: DASHBOARD_VIEW permission
     """
-    return {
-        "callVolumeTrend": [
-            {"date": "Mon", "calls": 245, "answered": 230},
-            {"date": "Tue", "calls": 278, "answered": 265},
-            {"date": "Wed", "calls": 312, "answered": 298},
-            {"date": "Thu", "calls": 289, "answered": 275},
-            {"date": "Fri", "calls": 335, "answered": 320},
-            {"date": "Sat", "calls": 198, "answered": 185},
-            {"date": "Sun", "calls": 156, "answered": 148},
-        ],
-        "callsByHour": [
-            {"hour": "8 AM", "calls": 45},
-            {"hour": "9 AM", "calls": 78},
-            {"hour": "10 AM", "calls": 95},
-            {"hour": "11 AM", "calls": 112},
-            {"hour": "12 PM", "calls": 98},
-            {"hour": "1 PM", "calls": 85},
-            {"hour": "2 PM", "calls": 102},
-            {"hour": "3 PM", "calls": 118},
-            {"hour": "4 PM", "calls": 95},
-            {"hour": "5 PM", "calls": 67},
-        ],
-        "satisfactionBreakdown": [
-            {"name": "Excellent (5)", "value": 45},
-            {"name": "Good (4)", "value": 32},
-            {"name": "Average (3)", "value": 15},
-            {"name": "Poor (2)", "value": 6},
-            {"name": "Very Poor (1)", "value": 2},
-        ],
-        "agentPerformance": [
-            {"agent": "Sarah Miller", "calls": 89, "avgTime": 4.5, "satisfaction": 4.8},
-            {"agent": "John Davis", "calls": 82, "avgTime": 5.2, "satisfaction": 4.6},
-            {"agent": "Emily Chen", "calls": 78, "avgTime": 4.8, "satisfaction": 4.7},
-            {"agent": "Michael Brown", "calls": 75, "avgTime": 5.5, "satisfaction": 4.5},
-            {"agent": "Lisa Anderson", "calls": 71, "avgTime": 5.0, "satisfaction": 4.6},
-        ],
-    }
+    return _etag_json_response(request, _DASHBOARD_CHARTS_JSON, _DASHBOARD_CACHE_CONTROL, _DASHBOARD_CHARTS_ETAG)
 
 # ============================================================================
 # Power BI Endpoints
@@ -1649,15 +1953,22 @@ async def generate_conversation_title(
 # Chat History Management Endpoints
 # ============================================================================
 
+# Serializes a whole summary list in one call (compiled once) instead of
+# FastAPI re-validating and encoding the response_model item by item
+_CONVERSATION_LIST_ADAPTER = TypeAdapter(List[ConversationSummary])
+
 @app.get("/api/chat/conversations", response_model=List[ConversationSummary])
 async def get_user_conversations(
     limit: int = 50,
     agent_id: Optional[str] = None,
-    user_permissions: UserPermissions = Depends(require_permission(Permission.CHAT_VIEW))
+    continuation_token: Optional[str] = Header(None, alias="x-continuation-token"),
+    user_permissions: UserPermissions = Depends(require_user_permission(Permission.CHAT_VIEW))
 ):
     """
     Get conversation history for the authenticated user.
-    Returns a list of conversation summaries.
+    Returns a list of conversation summaries. When more conversations are
+    available, the x-continuation-token response header carries the token to
+    send back (as the same request header) for the next page.
     Requires: CHAT_VIEW permission
     """
     if not conversation_service:
@@ -1667,19 +1978,20 @@ async def get_user_conversations(
         )
     
     user_id = user_permissions.user_id
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID not found in token"
-        )
     
     try:
-        conversations = await conversation_service.get_user_conversations(
+        conversations, next_token = await conversation_service.get_user_conversations(
             user_id=user_id, 
             limit=limit,
-            agent_id=agent_id
+            agent_id=agent_id,
+            continuation_token=continuation_token
+        )
+        headers = {"x-continuation-token": next_token} if next_token else None
+        return Response(
+            content=_CONVERSATION_LIST_ADAPTER.dump_json(conversations),
+            media_type="application/json",
+            headers=headers
         )
-        return conversations
     except Exception as e:
         logger.error(f"Failed to get conversations for user {user_id}: {e}")
         raise HTTPException(
@@ -1690,7 +2002,7 @@ async def get_user_conversations(
 @app.post("/api/chat/conversations", response_model=ChatConversation, status_code=status.HTTP_201_CREATED)
 async def create_conversation(
     request: CreateConversationRequest,
-    user_permissions: UserPermissions = Depends(require_permission(Permission.CHAT_CREATE))
+    user_permissions: UserPermissions = Depends(require_user_permission(Permission.CHAT_CREATE))
 ):
     """
     Create a new chat conversation.
@@ -1705,12 +2017,6 @@ async def create_conversation(
     user_id = user_permissions.user_id
     user_name = user_permissions.user_email.split('@')[0] if user_permissions.user_email else "User"
     
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID not found in token"
-        )
-    
     try:
         # Use the AI Foundry thread ID from session_data if available,
         # otherwise generate a new UUID (e.g., for Copilot Studio)
@@ -1739,7 +2045,7 @@ async def create_conversation(
 @app.get("/api/chat/conversations/{conversation_id}", response_model=ChatConversation)
 async def get_conversation(
     conversation_id: str,
-    user_permissions: UserPermissions = Depends(require_permission(Permission.CHAT_VIEW))
+    user_permissions: UserPermissions = Depends(require_user_permission(Permission.CHAT_VIEW))
 ):
     """
     Get a specific conversation with full message history.
@@ -1752,11 +2058,6 @@ async def get_conversation(
         )
     
     user_id = user_permissions.user_id
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID not found in token"
-        )
     
     try:
         conversation = await conversation_service.get_conversation(conversation_id, user_id)
@@ -1776,10 +2077,27 @@ async def get_conversation(
             detail="Failed to retrieve conversation"
         )
 
+async def _stream_json_array(messages, conversation_id: str):
+    """Yield a JSON array of messages one element at a time."""
+    yield b"["
+    first = True
+    try:
+        async for message in messages:
+            if not first:
+                yield b","
+            first = False
+            yield message.model_dump_json().encode()
+    except Exception as e:
+        # Headers are already sent; re-raise so the connection is aborted and the
+        # client sees a truncated body rather than a silently partial history
+        logger.error(f"Failed while streaming messages for conversation {conversation_id}: {e}")
+        raise
+    yield b"]"
+
 @app.get("/api/chat/conversations/{conversation_id}/messages", response_model=List[ChatMessage])
 async def get_messages(
     conversation_id: str,
-    user_permissions: UserPermissions = Depends(require_permission(Permission.CHAT_VIEW))
+    user_permissions: UserPermissions = Depends(require_user_permission(Permission.CHAT_VIEW))
 ):
     """
     Get all messages for a specific conversation/session.
@@ -1792,27 +2110,28 @@ async def get_messages(
         )
     
     user_id = user_permissions.user_id
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID not found in token"
-        )
     
     try:
-        messages = await conversation_service.get_conversation_messages(conversation_id, user_id)
-        return messages
+        messages = await conversation_service.open_message_stream(conversation_id, user_id)
     except Exception as e:
         logger.error(f"Failed to get messages for conversation {conversation_id}: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to retrieve messages"
         )
+    
+    # Encode message-by-message so long histories are never materialized
+    # as one list plus one response body
+    return StreamingResponse(
+        _stream_json_array(messages, conversation_id),
+        media_type="application/json"
+    )
 
 @app.post("/api/chat/conversations/{conversation_id}/messages")
 async def add_message(
     conversation_id: str,
     message: ChatMessage,
-    user_permissions: UserPermissions = Depends(require_permission(Permission.CHAT_CREATE))
+    user_permissions: UserPermissions = Depends(require_user_permission(Permission.CHAT_CREATE))
 ):
     """
     Add a message to an existing conversation.
@@ -1825,11 +2144,6 @@ async def add_message(
         )
     
     user_id = user_permissions.user_id
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID not found in token"
-        )
     
     try:
         created_message_id = await conversation_service.add_message(
@@ -1870,7 +2184,7 @@ class SessionDataUpdateRequest(BaseModel):
 async def update_conversation_session_data(
     conversation_id: str,
     request: SessionDataUpdateRequest,
-    user_permissions: UserPermissions = Depends(require_permission(Permission.CHAT_CREATE))
+    user_permissions: UserPermissions = Depends(require_user_permission(Permission.CHAT_CREATE))
 ):
     """
     Update the session_data for a conversation (e.g. to store AI Foundry thread ID).
@@ -1883,11 +2197,6 @@ async def update_conversation_session_data(
         )
     
     user_id = user_permissions.user_id
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID not found in token"
-        )
     
     try:
         success = await conversation_service.update_session_data(
@@ -1919,7 +2228,7 @@ async def update_message_feedback(
     conversation_id: str,
     message_id: str,
     request: MessageFeedbackRequest,
-    user_permissions: UserPermissions = Depends(require_permission(Permission.CHAT_CREATE))
+    user_permissions: UserPermissions = Depends(require_user_permission(Permission.CHAT_CREATE))
 ):
     """
     Update the feedback (thumbs up/down) for a specific message.
@@ -1931,13 +2240,6 @@ async def update_message_feedback(
             detail="Chat history service is not available."
         )
     
-    user_id = user_permissions.user_id
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID not found in token"
-        )
-    
     # Validate feedback value
     if request.feedback is not None and request.feedback not in ['positive', 'negative']:
         raise HTTPException(
@@ -1971,7 +2273,7 @@ async def update_message_feedback(
 @app.delete("/api/chat/conversations/{conversation_id}")
 async def delete_conversation(
     conversation_id: str,
-    user_permissions: UserPermissions = Depends(require_permission(Permission.CHAT_DELETE))
+    user_permissions: UserPermissions = Depends(require_user_permission(Permission.CHAT_DELETE))
 ):
     """
     Delete (soft delete) a conversation.
@@ -1984,11 +2286,6 @@ async def delete_conversation(
         )
     
     user_id = user_permissions.user_id
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID not found in token"
-        )
     
     try:
         success = await conversation_service.delete_conversation(conversation_id, user_id)
@@ -2013,8 +2310,20 @@ async def delete_conversation(
 # Query Template Management Endpoints
 # ============================================================================
 
+async def _get_query_template_or_500(template_id: str, user_id: Optional[str]) -> Optional[QueryTemplate]:
+    """Look up a template, turning storage errors into a 500 response."""
+    try:
+        return await query_template_service.get_template(template_id, user_id)
+    except Exception as e:
+        logger.error(f"Failed to get query template {template_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve query template"
+        )
+
 @app.get("/api/query-templates", response_model=QueryTemplateList)
 async def list_query_templates(
+    request: Request,
     category: Optional[str] = None,
     user_permissions: UserPermissions = Depends(require_permission(Permission.TEMPLATES_VIEW))
 ):
@@ -2023,24 +2332,30 @@ async def list_query_templates(
     Optionally filter by category.
     Requires: TEMPLATES_VIEW permission
     """
-    user_id = user_permissions.user_id
-    
-    templates = list(query_templates_db.values())
-    
-    # Filter by category if provided
-    if category:
-        templates = [t for t in templates if t.category == category]
+    if not query_template_service:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Query template service is not available."
+        )
     
-    # Filter to show only user's own templates or public templates
-    filtered_templates = [
-        t for t in templates
-        if t.user_id is None or t.user_id == user_id
-    ]
+    # Only the user's own templates and public templates are returned
+    try:
+        filtered_templates = await query_template_service.list_templates(
+            user_id=user_permissions.user_id,
+            category=category
+        )
+    except Exception as e:
+        logger.error(f"Failed to list query templates: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve query templates"
+        )
     
-    return QueryTemplateList(
+    template_list = QueryTemplateList(
         templates=filtered_templates,
         total=len(filtered_templates)
     )
+    return _etag_json_response(request, template_list.model_dump_json().encode())
 
 @app.post("/api/query-templates", response_model=QueryTemplate, status_code=status.HTTP_201_CREATED)
 async def create_query_template(
@@ -2051,13 +2366,19 @@ async def create_query_template(
     Create a new query template (protected endpoint).
     Requires: TEMPLATES_CREATE permission
     """
+    if not query_template_service:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Query template service is not available."
+        )
+    
     user_id = user_permissions.user_id
     
     # Generate unique ID
     template_id = str(uuid.uuid4())
     
     # Create template
-    now = datetime.utcnow()
+    now = datetime.now(timezone.utc)
     template = QueryTemplate(
         id=template_id,
         name=template_data.name,
@@ -2071,13 +2392,21 @@ async def create_query_template(
         updated_at=now
     )
     
-    query_templates_db[template_id] = template
+    try:
+        await query_template_service.create_template(template)
+    except Exception as e:
+        logger.error(f"Failed to create query template {template_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to create query template"
+        )
     logger.info(f"Created query template: {template_id} by user: {user_id}")
     
     return template
 
 @app.get("/api/query-templates/{template_id}", response_model=QueryTemplate)
 async def get_query_template(
+    request: Request,
     template_id: str,
     user_permissions: UserPermissions = Depends(require_permission(Permission.TEMPLATES_VIEW))
 ):
@@ -2085,13 +2414,20 @@ async def get_query_template(
     Get a specific query template by ID (protected endpoint).
     Requires: TEMPLATES_VIEW permission
     """
-    if template_id not in query_templates_db:
+    if not query_template_service:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Query template service is not available."
+        )
+    
+    template = await _get_query_template_or_500(template_id, user_permissions.user_id)
+    if not template:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Query template not found"
         )
     
-    return query_templates_db[template_id]
+    return _etag_json_response(request, template.model_dump_json().encode())
 
 @app.put("/api/query-templates/{template_id}", response_model=QueryTemplate)
 async def update_query_template(
@@ -2103,14 +2439,19 @@ async def update_query_template(
     Update an existing query template (protected endpoint).
     Requires: TEMPLATES_UPDATE permission
     """
-    if template_id not in query_templates_db:
+    if not query_template_service:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Query template not found"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Query template service is not available."
         )
     
-    template = query_templates_db[template_id]
     user_id = user_permissions.user_id
+    template = await _get_query_template_or_500(template_id, user_id)
+    if not template:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Query template not found"
+        )
     
     # Check ownership (only owner can update)
     if template.user_id and template.user_id != user_id:
@@ -2121,11 +2462,19 @@ async def update_query_template(
     
     # Update fields
     update_data = template_update.model_dump(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(template, field, value)
-    
-    template.updated_at = datetime.utcnow()
-    query_templates_db[template_id] = template
+    try:
+        template = await query_template_service.update_template(template, update_data)
+    except Exception as e:
+        logger.error(f"Failed to update query template {template_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to update query template"
+        )
+    if not template:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Query template not found"
+        )
     
     logger.info(f"Updated query template: {template_id} by user: {user_id}")
     
@@ -2140,14 +2489,19 @@ async def delete_query_template(
     Delete a query template (protected endpoint).
     Requires: TEMPLATES_DELETE permission
     """
-    if template_id not in query_templates_db:
+    if not query_template_service:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Query template not found"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Query template service is not available."
         )
     
-    template = query_templates_db[template_id]
     user_id = user_permissions.user_id
+    template = await _get_query_template_or_500(template_id, user_id)
+    if not template:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Query template not found"
+        )
     
     # Check ownership (only owner can delete)
     if template.user_id and template.user_id != user_id:
@@ -2156,53 +2510,23 @@ async def delete_query_template(
             detail="You don't have permission to delete this template"
         )
     
-    del query_templates_db[template_id]
+    try:
+        deleted = await query_template_service.delete_template(template)
+    except Exception as e:
+        logger.error(f"Failed to delete query template {template_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to delete query template"
+        )
+    if not deleted:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Query template not found"
+        )
     logger.info(f"Deleted query template: {template_id} by user: {user_id}")
     
     return None
 
-# Initialize with some default templates
-def initialize_default_templates():
-    """Initialize some default query templates."""
-    default_templates = [
-        QueryTemplate(
-            id=str(uuid.uuid4()),
-            name="Get Agent Performance",
-            description="Query agent performance metrics",
-            template="Show me performance metrics for {agent_name} in the last {time_period}",
-            category="Performance",
-            is_active=True,
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        ),
-        QueryTemplate(
-            id=str(uuid.uuid4()),
-            name="Call Volume Analysis",
-            description="Analyze call volume trends",
-            template="Analyze call volume trends for {date_range}",
-            category="Analytics",
-            is_active=True,
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        ),
-        QueryTemplate(
-            id=str(uuid.uuid4()),
-            name="Customer Satisfaction Report",
-            description="Get customer satisfaction insights",
-            template="Generate customer satisfaction report for {period} with breakdown by {metric}",
-            category="Reports",
-            is_active=True,
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        ),
-    ]
-    
-    for template in default_templates:
-        query_templates_db[template.id] = template
-
-# Initialize default templates on startup
-initialize_default_templates()
-
 # ============================================================================
 # RBAC Management Endpoints
 # ============================================================================
@@ -2299,4 +2623,20 @@ async def list_available_permissions(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Multiple workers are opt-in (WEB_CONCURRENCY) and need Cosmos DB, since
+    # in-memory state is per worker; rate limits also apply per worker
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and not get_settings().COSMOS_DB_ACCOUNT_URI:
+        logger.error("❌ WEB_CONCURRENCY > 1 requires COSMOS_DB_ACCOUNT_URI; starting a single worker")
+        workers = 1
+    # loop/http "auto" pick uvloop + httptools when installed (uvicorn[standard]).
+    # Worker processes need an import string; a single worker reuses this app
+    # object instead of importing (and setting up) main.py a second time.
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=workers
+    )
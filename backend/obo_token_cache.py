@@ -0,0 +1,79 @@
+"""
+In-process cache for On-Behalf-Of (OBO) access tokens.
+Lets the Copilot Studio, AI Foundry and Power BI services skip the MSAL
+token exchange while a downstream token obtained for the same user token
+is still valid.
+"""
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional, Tuple
+from cachetools import TLRUCache
+import hashlib
+import threading
+import time
+
+# (token, digest) for the bearer token verified on the current request, so
+# downstream caches keyed by the same token don't hash it a second time
+_current_token_digest: ContextVar[Optional[Tuple[str, bytes]]] = ContextVar(
+    "current_token_digest", default=None
+)
+
+
+def set_current_token_digest(token: str, digest: bytes) -> None:
+    """Record the BLAKE2b-128 digest computed for this request's bearer token."""
+    _current_token_digest.set((token, digest))
+
+
+def token_digest(token: str) -> bytes:
+    """BLAKE2b-128 digest of a token, reusing the one recorded for this request."""
+    current = _current_token_digest.get()
+    if current is not None and current[0] is token:
+        return current[1]
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class OboTokenCache:
+    """
+    Downstream access tokens keyed by (BLAKE2b hash of the user token, scopes).
+    The user token itself is never stored. Entries expire a safety margin
+    before the downstream token's own expiry.
+    """
+
+    def __init__(self, maxsize: int = 4096, expiry_margin: float = 300.0):
+        """
+        Args:
+            maxsize: Maximum number of cached tokens
+            expiry_margin: Seconds before expiry at which a token is no longer served
+        """
+        self._expiry_margin = expiry_margin
+        # Values are (access_token, expires_at); each entry expires at its own deadline
+        self._cache: TLRUCache = TLRUCache(
+            maxsize=maxsize,
+            ttu=lambda _key, value, _now: value[1],
+            timer=time.time
+        )
+        # MSAL calls run in worker threads, so guard the (non thread-safe) cache
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_token: str, scopes: Iterable[str]) -> Tuple[bytes, Tuple[str, ...]]:
+        return token_digest(user_token), tuple(scopes)
+
+    def get(self, user_token: str, scopes: Iterable[str]) -> Optional[str]:
+        """Return a cached access token for this user token and scopes, if still valid."""
+        key = self._key(user_token, scopes)
+        with self._lock:
+            entry = self._cache.get(key)
+        return entry[0] if entry else None
+
+    def put(self, user_token: str, scopes: Iterable[str], result: Dict) -> None:
+        """Cache a successful MSAL token result until shortly before it expires."""
+        access_token = result.get("access_token")
+        expires_in = result.get("expires_in")
+        if not access_token or not isinstance(expires_in, (int, float)):
+            return
+        expires_at = time.time() + expires_in - self._expiry_margin
+        if expires_at <= time.time():
+            return
+        key = self._key(user_token, scopes)
+        with self._lock:
+            self._cache[key] = (access_token, expires_at)
@@ -8,6 +8,7 @@ from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 import httpx
 from msal import ConfidentialClientApplication
+from obo_token_cache import OboTokenCache
 
 logger = logging.getLogger(__name__)
 
@@ -82,18 +83,35 @@ class PowerBIService:
         import os
         self.verify_ssl = os.getenv("DISABLE_SSL_VERIFY", "false").lower() != "true"
         
+        # Shared HTTP client so Power BI REST calls reuse pooled keep-alive
+        # connections instead of paying TCP + TLS per call (created lazily)
+        self._http_client: Optional[httpx.AsyncClient] = None
+        
         # Initialize MSAL confidential client
         self.msal_app = ConfidentialClientApplication(
             client_id=self.client_id,
             client_credential=self.client_secret,
             authority=f"https://login.microsoftonline.com/{self.tenant_id}"
         )
+        self._obo_cache = OboTokenCache()
         
         auth_mode = "Service Principal" if use_service_principal else "OBO flow"
         logger.info(
             f"PowerBI Service initialized with {auth_mode}: workspace={workspace_id}, report={report_id}"
         )
     
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Return the shared HTTP client, creating it on first use."""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(verify=self.verify_ssl)
+        return self._http_client
+    
+    async def close(self):
+        """Close the shared HTTP client."""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+    
     async def _get_access_token(self, user_access_token: Optional[str] = None) -> str:
         """
         Acquire Power BI access token.
@@ -130,6 +148,11 @@ class PowerBIService:
             if not user_access_token:
                 raise Exception("User access token is required for OBO flow")
             
+            # Skip the OBO exchange while a token for this user is still valid
+            cached_token = self._obo_cache.get(user_access_token, [self.POWER_BI_SCOPE])
+            if cached_token:
+                return cached_token
+            
             logger.info("Acquiring Power BI access token via OBO flow")
             
             result = await asyncio.to_thread(
@@ -144,6 +167,7 @@ class PowerBIService:
                 raise Exception(f"Failed to acquire Power BI access token: {error_msg}")
             
             logger.info("Power BI access token acquired successfully via OBO")
+            self._obo_cache.put(user_access_token, [self.POWER_BI_SCOPE], result)
             return result["access_token"]
     
     async def get_report_metadata(self, access_token: str) -> Dict[str, Any]:
@@ -167,20 +191,20 @@ class PowerBIService:
         
         logger.info(f"Fetching Power BI report metadata: {self.report_id}")
         
-        async with httpx.AsyncClient(verify=self.verify_ssl) as client:
-            response = await client.get(
-                url,
-                headers={"Authorization": f"Bearer {access_token}"}
-            )
-            
-            if response.status_code != 200:
-                error_msg = f"Failed to fetch report metadata: {response.status_code} {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+        client = self._get_http_client()
+        response = await client.get(
+            url,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        
+        if response.status_code != 200:
+            error_msg = f"Failed to fetch report metadata: {response.status_code} {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
             
-            report_data = response.json()
-            logger.info(f"Report metadata retrieved: {report_data.get('name', 'unknown')}")
-            return report_data
+        report_data = response.json()
+        logger.info(f"Report metadata retrieved: {report_data.get('name', 'unknown')}")
+        return report_data
     
     async def generate_embed_token(
         self,
@@ -233,30 +257,30 @@ class PowerBIService:
         
         logger.info(f"Generating Power BI embed token for report: {self.report_id}")
         
-        async with httpx.AsyncClient(verify=self.verify_ssl) as client:
-            response = await client.post(
-                url,
-                json=request_body,
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Content-Type": "application/json"
-                }
-            )
-            
-            if response.status_code != 200:
-                error_msg = f"Failed to generate embed token: {response.status_code} {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-            
-            result = response.json()
-            embed_token = result.get("token")
+        client = self._get_http_client()
+        response = await client.post(
+            url,
+            json=request_body,
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json"
+            }
+        )
+        
+        if response.status_code != 200:
+            error_msg = f"Failed to generate embed token: {response.status_code} {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
             
-            if not embed_token:
-                logger.error("Embed token not found in response")
-                raise Exception("Embed token not found in response")
+        result = response.json()
+        embed_token = result.get("token")
+        
+        if not embed_token:
+            logger.error("Embed token not found in response")
+            raise Exception("Embed token not found in response")
             
-            logger.info("Embed token generated successfully")
-            return embed_token
+        logger.info("Embed token generated successfully")
+        return embed_token
     
     async def get_embed_config(
         self, 
@@ -357,24 +381,25 @@ class PowerBIService:
         
         logger.info(f"Requesting PDF export for report: {target_report_id}")
         
-        async with httpx.AsyncClient(timeout=30.0, verify=self.verify_ssl) as client:
-            response = await client.post(
-                url,
-                json=request_body,
-                headers={
-                    "Authorization": f"Bearer {powerbi_access_token}",
-                    "Content-Type": "application/json"
-                }
-            )
-            
-            if response.status_code != 202:
-                error_msg = f"Failed to export report: {response.status_code} - {response.text}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+        client = self._get_http_client()
+        response = await client.post(
+            url,
+            timeout=30.0,
+            json=request_body,
+            headers={
+                "Authorization": f"Bearer {powerbi_access_token}",
+                "Content-Type": "application/json"
+            }
+        )
+        
+        if response.status_code != 202:
+            error_msg = f"Failed to export report: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
             
-            export_data = response.json()
-            logger.info(f"Export initiated: {export_data.get('id')}")
-            return export_data
+        export_data = response.json()
+        logger.info(f"Export initiated: {export_data.get('id')}")
+        return export_data
     
     async def get_export_status(
         self,
@@ -407,22 +432,23 @@ class PowerBIService:
         
         logger.info(f"Checking export status: {export_id} for report: {target_report_id}")
         
-        async with httpx.AsyncClient(timeout=30.0, verify=self.verify_ssl) as client:
-            response = await client.get(
-                url,
-                headers={"Authorization": f"Bearer {powerbi_access_token}"}
-            )
-            
-            # Power BI returns 202 (Accepted) while export is in progress, 200 when complete
-            if response.status_code not in [200, 202]:
-                error_msg = f"Failed to get export status: {response.status_code} - {response.text}"
-                logger.error(error_msg)
-                logger.error(f"URL: {url}")
-                raise Exception(error_msg)
+        client = self._get_http_client()
+        response = await client.get(
+            url,
+            timeout=30.0,
+            headers={"Authorization": f"Bearer {powerbi_access_token}"}
+        )
+        
+        # Power BI returns 202 (Accepted) while export is in progress, 200 when complete
+        if response.status_code not in [200, 202]:
+            error_msg = f"Failed to get export status: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            logger.error(f"URL: {url}")
+            raise Exception(error_msg)
             
-            export_status = response.json()
-            logger.info(f"Export status: {export_status.get('status', 'Unknown')}")
-            return export_status
+        export_status = response.json()
+        logger.info(f"Export status: {export_status.get('status', 'Unknown')}")
+        return export_status
     
     async def get_export_file(
         self,
@@ -453,18 +479,19 @@ class PowerBIService:
         
         url = f"{self.POWER_BI_API_BASE}/groups/{target_workspace_id}/reports/{target_report_id}/exports/{export_id}/file"
         
-        async with httpx.AsyncClient(timeout=60.0, verify=self.verify_ssl) as client:
-            response = await client.get(
-                url,
-                headers={"Authorization": f"Bearer {powerbi_access_token}"}
-            )
-            
-            if response.status_code != 200:
-                error_msg = f"Failed to download export file: {response.status_code}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
+        client = self._get_http_client()
+        response = await client.get(
+            url,
+            timeout=60.0,
+            headers={"Authorization": f"Bearer {powerbi_access_token}"}
+        )
+        
+        if response.status_code != 200:
+            error_msg = f"Failed to download export file: {response.status_code}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
             
-            return response.content
+        return response.content
     
     def get_report_web_url(
         self,
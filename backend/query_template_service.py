@@ -0,0 +1,265 @@
+"""
+Query template service for managing reusable chatbot query templates.
+Templates are persisted in Cosmos DB (partitioned by owning user) so every
+worker process sees the same data. An in-memory store is used instead when
+Cosmos DB is not configured.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+from cosmos_service import CosmosDBService
+from models import QueryTemplate
+from datetime import datetime, timezone
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Namespace for deterministic built-in template IDs, so the same template has the
+# same ID in every worker process and across restarts
+_DEFAULT_TEMPLATE_NAMESPACE = uuid.UUID("6f3a7c52-2a44-4a0e-9a53-4d1b9f3c8e21")
+
+
+def _build_default_templates() -> List[QueryTemplate]:
+    """Build the built-in (public) query templates."""
+    now = datetime.now(timezone.utc)
+    specs = [
+        {
+            "name": "Get Agent Performance",
+            "description": "Query agent performance metrics",
+            "template": "Show me performance metrics for {agent_name} in the last {time_period}",
+            "category": "Performance",
+        },
+        {
+            "name": "Call Volume Analysis",
+            "description": "Analyze call volume trends",
+            "template": "Analyze call volume trends for {date_range}",
+            "category": "Analytics",
+        },
+        {
+            "name": "Customer Satisfaction Report",
+            "description": "Get customer satisfaction insights",
+            "template": "Generate customer satisfaction report for {period} with breakdown by {metric}",
+            "category": "Reports",
+        },
+    ]
+    return [
+        QueryTemplate(
+            id=str(uuid.uuid5(_DEFAULT_TEMPLATE_NAMESPACE, spec["name"])),
+            is_active=True,
+            created_at=now,
+            updated_at=now,
+            **spec
+        )
+        for spec in specs
+    ]
+
+
+class QueryTemplateService:
+    """
+    Service for storing and retrieving query templates.
+    Uses Cosmos DB when configured; otherwise an indexed in-memory store.
+    """
+
+    def __init__(self, cosmos_service: Optional[CosmosDBService] = None):
+        """
+        Initialize the query template service.
+
+        Args:
+            cosmos_service: Optional Cosmos DB service for persistence
+        """
+        self.cosmos_service = cosmos_service
+
+        # Fallback for when Cosmos is not available, plus secondary indexes.
+        # Index values are dicts used as insertion-ordered sets of template IDs.
+        self._templates: Dict[str, QueryTemplate] = {}
+        self._by_category: Dict[str, Dict[str, None]] = {}
+        self._by_user: Dict[Optional[str], Dict[str, None]] = {}
+        # Read-mostly snapshots of list results per (user_id, category);
+        # dropped on every in-memory write
+        self._list_snapshots: Dict[Tuple[Optional[str], Optional[str]], Tuple[QueryTemplate, ...]] = {}
+
+        for template in _build_default_templates():
+            self._insert(template)
+
+    async def initialize(self):
+        """Seed the built-in templates into Cosmos DB (once per database) so all workers share them."""
+        if not self.cosmos_service:
+            return
+        try:
+            if await self.cosmos_service.seed_query_templates(list(self._templates.values())):
+                logger.info("✓ Default query templates seeded in Cosmos DB")
+            else:
+                logger.info("✓ Default query templates already seeded in Cosmos DB")
+        except Exception as e:
+            logger.error(f"Failed to seed default query templates in Cosmos: {e}")
+
+    # ------------------------------------------------------------------
+    # In-memory store helpers
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _index_add(index: Dict, key, template_id: str) -> None:
+        index.setdefault(key, {})[template_id] = None
+
+    @staticmethod
+    def _index_remove(index: Dict, key, template_id: str) -> None:
+        ids = index.get(key)
+        if ids is not None:
+            ids.pop(template_id, None)
+            if not ids:
+                del index[key]
+
+    def _insert(self, template: QueryTemplate) -> None:
+        """Store a template in memory and add it to the category/user indexes."""
+        self._templates[template.id] = template
+        self._index_add(self._by_category, template.category, template.id)
+        self._index_add(self._by_user, template.user_id, template.id)
+        self._list_snapshots.clear()
+
+    def _remove(self, template: QueryTemplate) -> None:
+        """Remove a template from memory and drop it from the category/user indexes."""
+        self._templates.pop(template.id, None)
+        self._index_remove(self._by_category, template.category, template.id)
+        self._index_remove(self._by_user, template.user_id, template.id)
+        self._list_snapshots.clear()
+
+    def _replace(self, old: QueryTemplate, new: QueryTemplate) -> None:
+        """Swap in an updated copy, moving it to its new category bucket if the category changed."""
+        self._templates[new.id] = new
+        if new.category != old.category:
+            self._index_remove(self._by_category, old.category, new.id)
+            self._index_add(self._by_category, new.category, new.id)
+        self._list_snapshots.clear()
+
+    def _list_in_memory(self, user_id: Optional[str], category: Optional[str]) -> Tuple[QueryTemplate, ...]:
+        snapshot_key = (user_id, category or None)
+        snapshot = self._list_snapshots.get(snapshot_key)
+        if snapshot is not None:
+            return snapshot
+
+        # Show only public templates and the user's own templates
+        visible_ids = list(self._by_user.get(None, ()))
+        if user_id is not None:
+            visible_ids.extend(self._by_user.get(user_id, ()))
+
+        # Filter by category if provided
+        if category:
+            category_ids = self._by_category.get(category, {})
+            visible_ids = [i for i in visible_ids if i in category_ids]
+
+        snapshot = tuple(self._templates[i] for i in visible_ids)
+        if len(self._list_snapshots) >= 1024:
+            self._list_snapshots.clear()
+        self._list_snapshots[snapshot_key] = snapshot
+        return snapshot
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    # With Cosmos DB configured it is the only store: errors propagate to the
+    # caller rather than falling back to this worker's memory, where a write
+    # would be invisible to every other worker (and to later Cosmos reads).
+
+    async def list_templates(
+        self,
+        user_id: Optional[str],
+        category: Optional[str] = None
+    ) -> Sequence[QueryTemplate]:
+        """
+        List the public templates plus the user's own templates.
+
+        Args:
+            user_id: User identifier
+            category: Optional category filter
+
+        Returns:
+            Sequence of QueryTemplate objects (shared snapshot, do not mutate)
+        """
+        if self.cosmos_service:
+            return await self.cosmos_service.list_query_templates(user_id, category)
+
+        return self._list_in_memory(user_id, category)
+
+    async def get_template(self, template_id: str, user_id: Optional[str]) -> Optional[QueryTemplate]:
+        """
+        Get a template by ID from the user's own or the public templates.
+
+        Args:
+            template_id: Template identifier
+            user_id: User identifier (selects the owner partition to read)
+
+        Returns:
+            QueryTemplate object or None if not found
+        """
+        if self.cosmos_service:
+            template = await self.cosmos_service.get_query_template(template_id, user_id)
+            if template is None and user_id is not None:
+                template = await self.cosmos_service.get_query_template(template_id, None)
+            return template
+
+        # Same visibility as Cosmos and list_templates: public or the user's own
+        template = self._templates.get(template_id)
+        if template is not None and template.user_id not in (None, user_id):
+            return None
+        return template
+
+    async def create_template(self, template: QueryTemplate) -> QueryTemplate:
+        """
+        Store a new template.
+
+        Args:
+            template: Fully populated template (ID and timestamps set)
+
+        Returns:
+            The stored QueryTemplate
+        """
+        if self.cosmos_service:
+            await self.cosmos_service.create_query_template(template)
+            return template
+
+        self._insert(template)
+        return template
+
+    async def update_template(self, template: QueryTemplate, update_data: dict) -> Optional[QueryTemplate]:
+        """
+        Apply field updates to a copy of a template and persist it. The original
+        object (which may be shared by in-memory list snapshots) is left untouched.
+
+        Args:
+            template: Existing template (as returned by get_template)
+            update_data: Field values to change (already validated)
+
+        Returns:
+            The updated QueryTemplate, or None if it was deleted in the meantime
+        """
+        updated = template.model_copy(
+            update={**update_data, "updated_at": datetime.now(timezone.utc)}
+        )
+
+        if self.cosmos_service:
+            if not await self.cosmos_service.replace_query_template(updated):
+                return None
+            return updated
+
+        current = self._templates.get(updated.id)
+        if current is None:
+            return None
+        self._replace(current, updated)
+        return updated
+
+    async def delete_template(self, template: QueryTemplate) -> bool:
+        """
+        Delete a template.
+
+        Args:
+            template: Existing template (as returned by get_template)
+
+        Returns:
+            True if deleted, False if it no longer exists
+        """
+        if self.cosmos_service:
+            return await self.cosmos_service.delete_query_template(template.id, template.user_id)
+
+        if template.id in self._templates:
+            self._remove(template)
+            return True
+        return False